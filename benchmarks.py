@@ -0,0 +1,511 @@
+"""
+Benchmarks for the helper functions in utils.py.
+
+Run all benchmarks with ``python benchmarks.py`` or selected ones with
+``python benchmarks.py n_jobs``.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mne
+import numpy as np
+from scipy.signal import welch
+from scipy.stats import norm
+
+from utils import (_MEDIANS, IrasaCache, _cached_resample_plan,
+                   _fit_aperiodic, _peak_spectrum, calc_psd,
+                   detect_plateau_onset, elec_phys_psd, elec_phys_signal,
+                   elec_phys_signals, irasa, irasa_adaptive, irasa_factors,
+                   irasa_sliding, irasa_stream, irasa_sweep,
+                   simulate_signals, simulate_to_npy)
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    """Return the best wall-clock time of repeat calls in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(func, *args, **kwargs):
+    """Return the peak memory allocated by func in MB."""
+    tracemalloc.start()
+    func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def simulate_channels(n_chan=9, sample_rate=2400, duration=180):
+    """Simulate n_chan channels like in Computation_time.ipynb."""
+    return np.array([elec_phys_signal(1, [(10, 1, 2)],
+                                      sample_rate=sample_rate,
+                                      duration=duration, seed=seed)[1]
+                     for seed in range(1, n_chan + 1)])
+
+
+def bench_n_jobs():
+    """Wall-clock scaling of irasa with the number of threads."""
+    data = simulate_channels()
+    hset = np.arange(1.1, 1.9, 0.01)
+    print(f"irasa, {data.shape[0]} channels, {len(hset)} resampling factors, "
+          f"{os.cpu_count()} CPUs available")
+    t_serial = timeit(irasa, data, sf=2400, hset=hset, repeat=1)
+    print(f"n_jobs=1: {t_serial:.1f}s")
+    for n_jobs in [2, 4, 8]:
+        if n_jobs > os.cpu_count():
+            break
+        t_parallel = timeit(irasa, data, sf=2400, hset=hset, n_jobs=n_jobs,
+                            repeat=1)
+        print(f"n_jobs={n_jobs}: {t_parallel:.1f}s "
+              f"(speedup {t_serial / t_parallel:.1f}x)")
+
+
+def bench_cache():
+    """Repeated irasa calls with a cold, warm in-memory, and disk cache."""
+    data = simulate_channels()
+    t_nocache = timeit(irasa, data, sf=2400, repeat=1)
+    print(f"no cache:             {t_nocache * 1e3:8.1f}ms")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = IrasaCache(cache_dir=cache_dir)
+        irasa(data, sf=2400, cache=cache)
+        t_memory = timeit(irasa, data, sf=2400, band=(2, 40), cache=cache)
+        print(f"in-memory hit:        {t_memory * 1e3:8.1f}ms")
+        t_nofit = timeit(irasa, data, sf=2400, return_fit=False, cache=cache)
+        print(f"in-memory, no fit:    {t_nofit * 1e3:8.1f}ms")
+        disk_cache = IrasaCache(cache_dir=cache_dir)
+        t_disk = timeit(irasa, data, sf=2400, cache=disk_cache, repeat=1)
+        print(f"disk hit (new cache): {t_disk * 1e3:8.1f}ms")
+
+
+def bench_fit_method():
+    """Aperiodic fit of 300 channels with curve_fit and lstsq."""
+    freqs = np.arange(1, 30.25, 0.25)
+    rng = np.random.default_rng(0)
+    slopes = rng.uniform(-3, 0, size=(300, 1))
+    psd = 10**(slopes * np.log10(freqs) + rng.normal(0, .1, (300, freqs.size)))
+    psd_osc = np.zeros_like(psd)
+    ch_names = [str(i) for i in range(300)]
+    for fit_method in ["curve_fit", "lstsq"]:
+        t_fit = timeit(_fit_aperiodic, freqs, psd, psd_osc, ch_names,
+                       fit_method)
+        print(f"{fit_method:9}: {t_fit * 1e3:8.2f}ms")
+
+
+def bench_decimate():
+    """irasa with and without decimation of 2400 Hz data for 1-30 Hz."""
+    data = simulate_channels()
+    t_full = timeit(irasa, data, sf=2400, repeat=1)
+    print(f"decimate=False: {t_full:.2f}s")
+    t_dec = timeit(irasa, data, sf=2400, decimate=True, repeat=1)
+    print(f"decimate=True:  {t_dec:.2f}s (speedup {t_full / t_dec:.0f}x)")
+
+
+def bench_max_denominator():
+    """Speed and accuracy of bounded-denominator resampling factors."""
+    data = simulate_channels()
+    hset = np.arange(1.1, 1.9, 0.01)
+    t_exact = timeit(irasa, data, sf=2400, hset=hset, repeat=1)
+    freqs, psd_ap, _, params = irasa(data, sf=2400, hset=hset)
+    print(f"exact:               {t_exact:5.1f}s")
+    for max_denominator in [50, 20]:
+        kwargs = dict(sf=2400, hset=hset, max_denominator=max_denominator)
+        t_bounded = timeit(irasa, data, repeat=1, **kwargs)
+        _, psd_ap_bounded, _, params_bounded = irasa(data, **kwargs)
+        h_error = np.abs(irasa_factors(hset, max_denominator)
+                         - np.round(hset, 4)).max()
+        psd_error = np.abs(np.log10(psd_ap_bounded / psd_ap)).max()
+        slope_error = np.abs(params_bounded.Slope - params.Slope).max()
+        print(f"max_denominator={max_denominator}: {t_bounded:5.1f}s, "
+              f"max |h error| {h_error:.4f}, "
+              f"max |log10 PSD error| {psd_error:.4f}, "
+              f"max |slope error| {slope_error:.4f}")
+
+
+def bench_stream():
+    """Peak memory of irasa and irasa_stream on a memory-mapped file."""
+    n_chan, sample_rate, duration = 9, 2400, 600
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "data.npy")
+        data = np.lib.format.open_memmap(
+            path, mode="w+", shape=(n_chan, sample_rate * duration - 2))
+        for seed in range(n_chan):
+            data[seed] = elec_phys_signal(1, [(10, 1, 2)], seed=seed + 1,
+                                          sample_rate=sample_rate,
+                                          duration=duration)[1]
+        data.flush()
+        del data
+        print(f"{n_chan} channels x {duration}s at {sample_rate}Hz "
+              f"({os.path.getsize(path) / 1e6:.0f}MB file)")
+        start = time.perf_counter()
+        mem = peak_memory(irasa, np.load(path), sf=sample_rate)
+        print(f"irasa:                    {mem:6.0f}MB peak, "
+              f"{time.perf_counter() - start:.0f}s")
+        for chunk_sec in [60, 10]:
+            start = time.perf_counter()
+            mem = peak_memory(irasa_stream, path, sf=sample_rate,
+                              chunk_sec=chunk_sec)
+            print(f"irasa_stream chunk_sec={chunk_sec:2}: {mem:6.0f}MB peak, "
+                  f"{time.perf_counter() - start:.0f}s")
+
+
+def bench_sliding():
+    """irasa_sliding against calling irasa on each window."""
+    data = simulate_channels(n_chan=3)
+    window_sec, sample_rate = 20, 2400
+    for step_sec in [10, 2]:
+        t_sliding = timeit(irasa_sliding, data, sf=sample_rate,
+                           window_sec=window_sec, step_sec=step_sec, repeat=1)
+        starts = np.arange(0, data.shape[1] / sample_rate - window_sec + 1e-9,
+                           step_sec)
+        windows = [data[:, int(start * sample_rate):
+                        int((start + window_sec) * sample_rate)]
+                   for start in starts]
+        start = time.perf_counter()
+        for window in windows:
+            irasa(window, sf=sample_rate, fit_method="lstsq")
+        t_loop = time.perf_counter() - start
+        print(f"{len(windows):3} windows: irasa loop {t_loop:5.1f}s, "
+              f"irasa_sliding {t_sliding:5.1f}s")
+
+
+def bench_median():
+    """Memory of the median over 80 resampling factors for 300 channels."""
+    n_factors, shape = 80, (300, 4801)
+    rng = np.random.default_rng(0)
+    psd_h = rng.lognormal(size=shape)
+
+    def aggregate(median_method, psd_dtype):
+        median = _MEDIANS[median_method](n_factors, psd_dtype)
+        for _ in range(n_factors):
+            median.update(psd_h)
+        return median.result()
+
+    for median_method, psd_dtype in [("exact", np.float64),
+                                     ("exact", np.float32),
+                                     ("p2", np.float64),
+                                     ("p2", np.float32)]:
+        mem = peak_memory(aggregate, median_method, psd_dtype)
+        print(f"{median_method:5} {np.dtype(psd_dtype).name:7}: "
+              f"{mem:6.0f}MB peak")
+
+    data = simulate_channels()
+    hset = np.arange(1.1, 1.9, 0.01)
+    _, psd_exact, _, params = irasa(data, sf=2400, hset=hset)
+    for kwargs in [dict(psd_dtype=np.float32), dict(median_method="p2")]:
+        _, psd_approx, _, params_approx = irasa(data, sf=2400, hset=hset,
+                                                **kwargs)
+        psd_error = np.abs(np.log10(psd_approx / psd_exact))
+        slope_error = np.abs(params_approx.Slope - params.Slope).max()
+        print(f"irasa {kwargs}: median |log10 PSD error| "
+              f"{np.median(psd_error):.4f}, max {psd_error.max():.4f}, "
+              f"max |slope error| {slope_error:.4f}")
+
+
+def bench_adaptive():
+    """Factors used, time, and accuracy of irasa_adaptive on 80 factors."""
+    data = simulate_channels()
+    hset = np.arange(1.1, 1.9, 0.01)
+    start = time.perf_counter()
+    _, psd_full, _, params = irasa(data, sf=2400, hset=hset,
+                                   fit_method="lstsq")
+    print(f"irasa, {len(hset)} factors: {time.perf_counter() - start:.1f}s")
+    for tol in [0.01, 0.005, 0.002]:
+        start = time.perf_counter()
+        _, psd_ap, _, params_ap, hset_used = irasa_adaptive(
+            data, sf=2400, hset=hset, tol=tol)
+        t_adaptive = time.perf_counter() - start
+        psd_error = np.median(np.abs(np.log10(psd_ap / psd_full)))
+        slope_error = np.abs(params_ap.Slope - params.Slope).max()
+        print(f"irasa_adaptive tol={tol}: {len(hset_used)} factors, "
+              f"{t_adaptive:.1f}s, median |log10 PSD error| {psd_error:.4f}, "
+              f"max |slope error| {slope_error:.4f}")
+
+
+def bench_sweep():
+    """irasa_sweep against one irasa call per hset."""
+    data = simulate_channels(n_chan=3)
+    sweeps = {"arange(1.1, h_max, 0.05), h_max=1.3...1.9":
+              [np.arange(1.1, h_max, 0.05) for h_max in np.arange(1.3, 2, .1)],
+              "linspace(1.1, h_max, 5), h_max=2, 8, 15 (Fig5)":
+              [np.linspace(1.1, h_max, 5) for h_max in [2, 8, 15]]}
+    for name, hsets in sweeps.items():
+        n_total = sum(len(hset) for hset in hsets)
+        n_unique = len(np.unique(np.round(np.concatenate(hsets), 4)))
+        start = time.perf_counter()
+        for hset in hsets:
+            irasa(data, sf=2400, hset=hset)
+        t_loop = time.perf_counter() - start
+        t_sweep = timeit(irasa_sweep, data, hsets, sf=2400, repeat=1)
+        print(f"{name}: {n_total} factors, {n_unique} unique, "
+              f"irasa loop {t_loop:.1f}s, irasa_sweep {t_sweep:.1f}s")
+
+
+def bench_chunk_channels():
+    """Peak memory of irasa on 60 channels with a memory budget."""
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((60, 2400 * 60))
+    print(f"60 channels x 60s at 2400Hz ({data.nbytes / 1e6:.0f}MB)")
+    for max_memory in [None, 1e9, 2.5e8]:
+        start = time.perf_counter()
+        mem = peak_memory(irasa, data, sf=2400, max_memory=max_memory,
+                          fit_method="lstsq")
+        t_chunk = time.perf_counter() - start
+        budget = "none" if max_memory is None else f"{max_memory / 1e6:.0f}MB"
+        print(f"max_memory {budget:>6}: {mem:5.0f}MB peak, {t_chunk:.1f}s")
+
+
+def bench_bad_segs():
+    """Resampling NaN-filled data vs. the good spans between bad segments."""
+    data = simulate_channels(duration=180)
+    ch_names = [f"EEG{i:03}" for i in range(len(data))]
+    raw = mne.io.RawArray(data * 1e-6, mne.create_info(ch_names, 2400, "eeg"),
+                          verbose=False)
+    onsets = np.arange(5, 180, 18)
+    raw.set_annotations(mne.Annotations(onsets, 2, "bad"))
+    data_nan = raw.get_data(reject_by_annotation="nan") * 1e6
+    print(f"{len(onsets)} bad segments of 2s in {data.shape[0]} channels x "
+          "180s at 2400Hz")
+    clean = irasa(data, sf=2400, return_fit=False)[1]
+    for label, func, args, kwargs in [
+            ("NaN resampling", irasa, (data_nan,),
+             dict(sf=2400, reject_bad_segs=False)),
+            ("good spans", irasa, (raw,), dict())]:
+        t_irasa = timeit(func, *args, repeat=1, return_fit=False, **kwargs)
+        psd_aperiodic = func(*args, return_fit=False, **kwargs)[1]
+        error = np.nanmean(np.abs(np.log10(psd_aperiodic / clean)))
+        print(f"{label:>14}: {t_irasa:.1f}s, mean |log10 error| vs. clean "
+              f"data {error:.3f}")
+
+
+def bench_calc_psd():
+    """Peak memory of the blockwise Welch PSD vs. scipy.signal.welch."""
+    rng = np.random.default_rng(0)
+    print("4 channels at 2400Hz, nperseg=9600")
+    for minutes in [5, 10, 20]:
+        data = rng.standard_normal((4, 2400 * 60 * minutes))
+        mem_welch = peak_memory(welch, data, 2400, nperseg=9600)
+        mem_mean = peak_memory(calc_psd, data, 2400, nperseg=9600)
+        mem_p2 = peak_memory(calc_psd, data, 2400, nperseg=9600,
+                             average="median", median_method="p2")
+        print(f"{minutes:2} min: welch {mem_welch:4.0f}MB, calc_psd mean "
+              f"{mem_mean:3.0f}MB, median p2 {mem_p2:3.0f}MB")
+    mem_irasa = peak_memory(irasa, data, sf=2400, fit_method="lstsq")
+    print(f"irasa on 20 min: {mem_irasa:.0f}MB peak")
+
+
+def bench_resample_plans():
+    """Per-call overhead of designing the resampling filters."""
+    data = simulate_channels(n_chan=1, sample_rate=1000, duration=10)
+    for hset in [np.arange(1.1, 1.95, 0.05), np.arange(1.1, 1.9, 0.01)]:
+        def irasa_cold():
+            _cached_resample_plan.cache_clear()
+            irasa(data, sf=1000, hset=hset, fit_method="lstsq")
+
+        t_cold = timeit(irasa_cold, repeat=20)
+        t_warm = timeit(irasa, data, sf=1000, hset=hset, fit_method="lstsq",
+                        repeat=20)
+        print(f"10s at 1000Hz, {len(hset)} factors: filters designed per "
+              f"call {t_cold * 1e3:.0f}ms, cached plans "
+              f"{t_warm * 1e3:.0f}ms")
+
+
+def bench_engine():
+    """Whole-signal vs. per-segment resampling against the ground truth."""
+    sample_rate, exponent = 2400, 1.5
+    signals = [elec_phys_signal(exponent, [(10, 1, 2)],
+                                sample_rate=sample_rate, seed=seed)
+               for seed in range(1, 10)]
+    aperiodic = np.array([signal[0] for signal in signals])
+    data = np.array([signal[1] for signal in signals])
+    freqs, truth = calc_psd(aperiodic, sample_rate, nperseg=4 * sample_rate)
+    truth = truth[:, (freqs >= 1) & (freqs <= 30)]
+    print(f"{data.shape[0]} channels x 180s at {sample_rate}Hz, "
+          f"exponent {exponent}")
+    for engine in ["signal", "segment"]:
+        t_engine = timeit(irasa, data, sf=sample_rate, engine=engine,
+                          fit_method="lstsq", repeat=1)
+        _, psd_aperiodic, _, fit_params = irasa(
+            data, sf=sample_rate, engine=engine, fit_method="lstsq")
+        error = np.abs(np.log10(psd_aperiodic / truth)).mean()
+        slope_error = np.abs(-fit_params["Slope"] - exponent).mean()
+        print(f"engine={engine:>7}: {t_engine:.1f}s, mean |log10 error| "
+              f"{error:.3f}, mean |slope error| {slope_error:.3f}")
+
+
+def bench_resampler():
+    """Polyphase vs. FFT resampling backends and the automatic choice."""
+    for sample_rate, duration in [(2400, 180), (1024, 256)]:
+        data = simulate_channels(n_chan=4, sample_rate=sample_rate,
+                                 duration=duration)
+        hset = np.arange(1.1, 1.9, 0.01)
+        psd_poly = irasa(data, sf=sample_rate, hset=hset,
+                         fit_method="lstsq")[1]
+        print(f"{data.shape[0]} channels x {data.shape[1]} samples, "
+              f"{len(hset)} factors")
+        for resampler in ["poly", "fft", "auto"]:
+            t_resampler = timeit(irasa, data, sf=sample_rate, hset=hset,
+                                 resampler=resampler, fit_method="lstsq",
+                                 repeat=1)
+            psd_aperiodic = irasa(data, sf=sample_rate, hset=hset,
+                                  resampler=resampler, fit_method="lstsq")[1]
+            diff = np.abs(np.log10(psd_aperiodic / psd_poly)).mean()
+            print(f"resampler={resampler:>4}: {t_resampler:.1f}s, mean "
+                  f"|log10 difference| to poly {diff:.4f}")
+
+
+def bench_simulation():
+    """Looped elec_phys_signal vs. batched elec_phys_signals."""
+    exponents = np.repeat([1, 1.5, 2], 4)
+    seeds = np.tile(np.arange(1, 5), 3)
+
+    def looped():
+        return [elec_phys_signal(exponent, [(10, 1, 2)], seed=seed)
+                for exponent, seed in zip(exponents, seeds)]
+
+    t_loop = timeit(looped, repeat=1)
+    print(f"{len(seeds)} signals of 180s at 2400Hz: loop {t_loop:.2f}s")
+    for dtype in [np.float64, np.float32]:
+        t_batch = timeit(elec_phys_signals, exponents, [(10, 1, 2)],
+                         seeds=seeds, dtype=dtype, repeat=1)
+        mem_batch = peak_memory(elec_phys_signals, exponents, [(10, 1, 2)],
+                                seeds=seeds, dtype=dtype)
+        print(f"batched {np.dtype(dtype).name}: {t_batch:.2f}s, "
+              f"{mem_batch:.0f}MB peak")
+
+
+def bench_simulate_parallel():
+    """Wall-clock scaling of simulate_signals with the number of threads."""
+    param_sets = [dict(exponent=exponent, periodic_params=[(10, 1, 2)])
+                  for exponent in np.linspace(1, 2, 16)]
+    print(f"{len(param_sets)} signals of 180s at 2400Hz, "
+          f"{os.cpu_count()} CPUs available")
+    for n_jobs in [1, 2, 4, 8]:
+        if n_jobs > os.cpu_count():
+            break
+        t_parallel = timeit(simulate_signals, param_sets, seed=1,
+                            n_jobs=n_jobs, repeat=1)
+        print(f"n_jobs={n_jobs}: {t_parallel:.2f}s")
+
+
+def bench_expected_psd():
+    """Welch PSD of simulated signals vs. the analytic expected PSD."""
+    params = dict(periodic_params=[(10, 1, 2)], nlv=1e-4)
+
+    def simulated():
+        signals = np.array(elec_phys_signal(1.5, **params))
+        return welch(signals, fs=2400, nperseg=2400)
+
+    t_simulated = timeit(simulated)
+    t_expected = timeit(elec_phys_psd, 1.5, **params, nperseg=2400)
+    t_noisy = timeit(elec_phys_psd, 1.5, **params, nperseg=2400,
+                     sampling_noise=True, rng=1)
+    print(f"180s at 2400Hz, 1s segments: simulate + welch "
+          f"{t_simulated * 1e3:.0f}ms, expected PSD {t_expected * 1e3:.0f}ms, "
+          f"with sampling noise {t_noisy * 1e3:.0f}ms")
+
+    # Agreement with the average over seeds
+    freqs, psd_aperiodic, _ = elec_phys_psd(1.5, **params, nperseg=2400)
+    aperiodic = elec_phys_signals(1.5, seeds=np.arange(1, 21), **params)[0]
+    psd_welch = welch(aperiodic, fs=2400, nperseg=2400)[1].mean(axis=0)
+    mask = (freqs >= 1) & (freqs <= 100)
+    error = np.abs(np.log10(psd_aperiodic[mask] / psd_welch[mask])).mean()
+    print(f"mean |log10 error| to the average of 20 seeds: {error:.4f}")
+
+
+def bench_peaks():
+    """Peak loop with scipy.stats.norm vs. the vectorized peak engine."""
+    freqs = np.fft.rfftfreq(180 * 2400, d=1 / 2400)[1:]
+    for n_peaks in [1, 10, 60]:
+        # Sawtooth-like harmonics
+        periodic_params = [(8 * k, 1 / k, 1) for k in range(1, n_peaks + 1)]
+
+        def loop():
+            return sum(amp * norm(freq, width).pdf(freqs)
+                       for freq, amp, width in periodic_params)
+
+        t_loop = timeit(loop)
+        t_vectorized = timeit(_peak_spectrum, periodic_params, freqs)
+        t_signal = timeit(elec_phys_signal, 1, periodic_params)
+        print(f"{n_peaks:>2} peaks on {freqs.size} bins: loop "
+              f"{t_loop * 1e3:.0f}ms, vectorized {t_vectorized * 1e3:.1f}ms, "
+              f"elec_phys_signal {t_signal * 1e3:.0f}ms")
+
+
+def bench_highpass():
+    """Time-domain vs. frequency-domain highpass, with and without peaks."""
+    print("180s at 2400Hz")
+    for periodic_params in [[(10, 1, 2)], None]:
+        for highpass_method in ["sosfilt", "fft"]:
+            t_signal = timeit(elec_phys_signal, 1, periodic_params, nlv=1e-4,
+                              highpass=True, highpass_method=highpass_method)
+            print(f"periodic_params={periodic_params}, "
+                  f"highpass_method={highpass_method}: "
+                  f"{t_signal * 1e3:.0f}ms")
+    expected = elec_phys_signal(1, [(10, 1, 2)], nlv=1e-4, highpass=True)[1]
+    result = elec_phys_signal(1, [(10, 1, 2)], nlv=1e-4, highpass=True,
+                              highpass_method="fft")[1]
+    diff = np.abs(result - expected)[10 * 2400:].max()
+    print(f"max |difference| after 10s: {diff / np.abs(expected).max():.1e} "
+          "of the signal range")
+
+
+def bench_simulate_to_npy():
+    """Peak memory of chunked simulation of one hour of 8 channels."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sim.npy")
+        t_sim = timeit(simulate_to_npy, path, 1, [(10, 1, 2)], nlv=1e-4,
+                       highpass=True, n_channels=8, seed=1, repeat=1)
+        mem_sim = peak_memory(simulate_to_npy, path, 1, [(10, 1, 2)],
+                              nlv=1e-4, highpass=True, n_channels=8, seed=1)
+        size = os.path.getsize(path) / 1e6
+    print(f"8 channels x 1h at 2400Hz ({size:.0f}MB file): {t_sim:.1f}s, "
+          f"{mem_sim:.0f}MB peak")
+
+
+def bench_plateau():
+    """FOOOF loop vs. cumulative-sum slopes for plateau detection."""
+    # Fig2-style simulated spectrum with white noise and line noise, and a
+    # Fig8-style search starting at 50Hz
+    sample_rate = 2400
+    _, signal = elec_phys_signal(2, [(10, 1, 2), (50, 0.05, 0.5)],
+                                 nlv=2e-4, sample_rate=sample_rate)
+    freq, psd = welch(signal, fs=sample_rate, nperseg=4 * sample_rate)
+    print(f"0.25Hz resolution, {freq.size} bins")
+    for f_start in [1, 50]:
+        t_fooof = timeit(detect_plateau_onset, freq, psd, f_start, repeat=1)
+        onset_fooof = detect_plateau_onset(freq, psd, f_start)
+        print(f"f_start={f_start}: fooof {t_fooof:.2f}s, onset "
+              f"{onset_fooof}Hz")
+        for method in ["slope", "slope_robust"]:
+            t_slope = timeit(detect_plateau_onset, freq, psd, f_start,
+                             method=method)
+            onset = detect_plateau_onset(freq, psd, f_start, method=method)
+            print(f"f_start={f_start}: {method} {t_slope * 1e3:.1f}ms, "
+                  f"onset {onset}Hz")
+        t_coarse = timeit(detect_plateau_onset, freq, psd, f_start,
+                          search="coarse_to_fine", repeat=1)
+        onset, n_fits = detect_plateau_onset(freq, psd, f_start,
+                                             search="coarse_to_fine",
+                                             return_n_fits=True)
+        n_fits_linear = detect_plateau_onset(freq, psd, f_start,
+                                             return_n_fits=True)[1]
+        print(f"f_start={f_start}: fooof coarse_to_fine {t_coarse:.2f}s, "
+              f"onset {onset}Hz, {n_fits} fits instead of {n_fits_linear}")
+    print("coarse_to_fine differs from linear only if the exponent dips "
+          "below thresh between two coarse positions above it")
+
+
+BENCHMARKS = {name[len("bench_"):]: func for name, func in globals().items()
+              if name.startswith("bench_")}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"\n=== {name} ===")
+        BENCHMARKS[name]()
@@ -1,5 +1,16 @@
+import mne
 import numpy as np
-from utils import elec_phys_signal
+import pytest
+from scipy.signal import resample, resample_poly, welch
+from scipy.stats import norm
+
+from utils import (IrasaCache, ResamplePlan, _FFTResampler, _fit_aperiodic,
+                   _peak_spectrum, _plateau_exponents, _plateau_starts,
+                   calc_psd, detect_plateau_onset, elec_phys_psd,
+                   elec_phys_signal, elec_phys_signals, irasa,
+                   irasa_adaptive, irasa_bands, irasa_factors, irasa_sliding,
+                   irasa_stream, irasa_sweep, resample_plans,
+                   simulate_signals, simulate_to_npy)
 
 
 # Test simulation of electrophysiological signals
@@ -37,4 +48,602 @@ def test_elec_phys_signal():
 
     # test impact of seed
     assert not np.allclose(elec_phys_signal(1, seed=0)[0],
-                           elec_phys_signal(1, seed=1)[0])
\ No newline at end of file
+                           elec_phys_signal(1, seed=1)[0])
+
+
+@pytest.fixture(scope="module")
+def signal():
+    """1/f signal with a 10 Hz peak, 60 s at 200 Hz."""
+    return elec_phys_signal(1, [(10, 1, 2)], sample_rate=200, duration=60)[1]
+
+
+def assert_irasa_equal(result, expected, exact=True, fit=False):
+    """Assert equal freqs, aperiodic and oscillatory PSDs of two irasa."""
+    compare = np.array_equal if exact else np.allclose
+    for res, res_expected in zip(result[:3], expected[:3]):
+        assert compare(res, res_expected)
+    if fit:
+        assert result[3].equals(expected[3])
+
+
+# Test parallel IRASA
+def test_irasa_n_jobs(signal):
+    signal = np.vstack([signal, signal[::-1]])
+    serial = irasa(signal, sf=200)
+    parallel = irasa(signal, sf=200, n_jobs=2)
+    assert_irasa_equal(parallel, serial, fit=True)
+
+
+# Test fitting several bands from one IRASA decomposition
+def test_irasa_bands():
+    _, signal = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                 duration=60)
+    bands = [(1, 30), (5, 40)]
+    freqs, psd_aperiodic, psd_osc, fit_params = irasa_bands(signal, bands,
+                                                            sf=200)
+    assert len(fit_params) == len(bands)
+    for band, (_, params) in zip(bands, fit_params.iterrows()):
+        freqs_band, _, _, params_band = irasa(signal, sf=200, band=band)
+        assert (params["fmin"], params["fmax"]) == band
+        assert np.allclose(params[params_band.columns[1:]].to_numpy(float),
+                           params_band.iloc[0, 1:].to_numpy(float))
+        assert freqs_band[0] >= band[0] and freqs_band[-1] <= band[1]
+
+
+# Test caching of IRASA decompositions
+def test_irasa_cache(tmp_path):
+    _, signal = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                 duration=60)
+    expected = irasa(signal, sf=200, band=(2, 40))
+    cache = IrasaCache(maxsize=1, cache_dir=tmp_path)
+    irasa(signal, sf=200, cache=cache)
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+    cached = irasa(signal, sf=200, band=(2, 40), cache=cache)
+    for res, res_cached in zip(expected[:3], cached[:3]):
+        assert np.array_equal(res, res_cached)
+    assert expected[3].equals(cached[3])
+
+    # new parameters give new entries, the in-memory cache is size limited
+    irasa(signal, sf=200, win_sec=2, cache=cache)
+    assert len(cache._memory) == 1
+    assert len(list(tmp_path.glob("*.npz"))) == 2
+
+    # disk cache is size limited
+    small_cache = IrasaCache(cache_dir=tmp_path / "small", max_disk_bytes=1)
+    irasa(signal, sf=200, cache=small_cache)
+    assert not list((tmp_path / "small").glob("*.npz"))
+
+    # long window arrays that only differ in the middle have different keys
+    window = np.hanning(2000)
+    window2 = window.copy()
+    window2[1000] = 0
+    assert (IrasaCache.key(signal, [("window", window)])
+            != IrasaCache.key(signal, [("window", window2)]))
+
+
+# Test batched least squares aperiodic fit
+def test_irasa_fit_lstsq():
+    freqs = np.arange(1, 30.25, 0.25)
+    noise = np.random.default_rng(0).normal(scale=.1, size=(3, freqs.size))
+    slopes = np.array([[-1], [-12], [3]])  # last two exceed the bounds
+    psd = 10**(2 + slopes * np.log10(freqs) + noise)
+    psd_osc = np.zeros_like(psd)
+    for fit_method in ["curve_fit", "lstsq"]:
+        params = _fit_aperiodic(freqs, psd, psd_osc, ["a", "b", "c"],
+                                fit_method)
+        assert np.allclose(params["Slope"][1:], [-10, 2])
+        if fit_method == "curve_fit":
+            expected = params
+    assert np.allclose(params.iloc[:, 1:].to_numpy(float),
+                       expected.iloc[:, 1:].to_numpy(float))
+
+
+# Test decimation before IRASA resampling
+def test_irasa_decimate():
+    _, signal = elec_phys_signal(1, [(10, 1, 2)], sample_rate=600,
+                                 duration=60)
+    freqs, _, _, params = irasa(signal, sf=600)
+    freqs_dec, _, _, params_dec = irasa(signal, sf=600, decimate=True)
+    assert np.array_equal(freqs, freqs_dec)
+    assert np.allclose(params["Slope"], params_dec["Slope"], atol=1e-2)
+
+    # band too close to Nyquist
+    with pytest.warns(UserWarning, match="Data is not decimated"):
+        irasa(signal, sf=600, band=(1, 150), decimate=True)
+
+
+# Test bounded-denominator resampling factors
+def test_irasa_max_denominator():
+    hset = np.arange(1.1, 1.9, 0.01)
+    assert np.array_equal(irasa_factors(hset), np.round(hset, 4))
+    hset_used = irasa_factors(hset, max_denominator=50)
+    assert np.abs(hset_used - hset).max() < 0.01
+    assert len(np.unique(hset_used)) == len(hset)
+    with pytest.warns(UserWarning, match="same ratio"):
+        irasa_factors(hset, max_denominator=10)
+
+    _, signal = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                 duration=60)
+    params = irasa(signal, sf=200, hset=hset)[3]
+    params_bounded = irasa(signal, sf=200, hset=hset, max_denominator=50)[3]
+    assert np.allclose(params["Slope"], params_bounded["Slope"], atol=1e-2)
+
+
+# Test chunked IRASA on memory-mapped and MNE data
+def test_irasa_stream(tmp_path):
+    aperiodic_signal, full_signal = elec_phys_signal(
+        1, [(10, 1, 2)], sample_rate=200, duration=60)
+    data = np.vstack([aperiodic_signal, full_signal])
+    expected = irasa(data, sf=200, kwargs_welch=dict(window='hann'))
+    np.save(tmp_path / "data.npy", data)
+    raw = mne.io.RawArray(data * 1e-6, mne.create_info(2, 200, "eeg"),
+                          verbose=False)
+    for source in [tmp_path / "data.npy", raw]:
+        result = irasa_stream(source, sf=200, chunk_sec=7)
+        assert np.allclose(result[0], expected[0])
+        assert np.allclose(result[1], expected[1])
+        assert np.allclose(result[2], expected[2])
+    with pytest.raises(ValueError):
+        irasa_stream(data, sf=200, kwargs_welch=dict(average='median'))
+
+
+# Test time-resolved IRASA
+def test_irasa_sliding():
+    _, signal1 = elec_phys_signal(1, sample_rate=200, duration=60, seed=1)
+    _, signal2 = elec_phys_signal(2, sample_rate=200, duration=60, seed=2)
+    signal = np.concatenate([signal1 / signal1.std(),
+                             signal2 / signal2.std()])
+    times, freqs, psd_aperiodic, psd_osc, fit_params = irasa_sliding(
+        signal, sf=200, window_sec=20, step_sec=10)
+    assert np.allclose(times, np.arange(10, 101, 10))
+    assert psd_aperiodic.shape == psd_osc.shape == (1, freqs.size, 10)
+    assert np.allclose(fit_params["Time"], times)
+    assert np.allclose(fit_params["Slope"][:4], -1, atol=.2)
+    assert np.allclose(fit_params["Slope"][-4:], -2, atol=.2)
+
+    # a single window over the whole signal equals irasa
+    expected = irasa(signal, sf=200, kwargs_welch=dict(window='hann'))
+    result = irasa_sliding(signal, sf=200, window_sec=signal.size / 200)
+    assert np.allclose(result[1], expected[0])
+    assert np.allclose(result[2][..., 0], expected[1])
+    assert np.allclose(result[3][..., 0], expected[2])
+    with pytest.raises(AssertionError, match="win_sec"):
+        irasa_sliding(signal, sf=200, window_sec=2)
+
+
+# Test approximate and low-precision median over resampling factors
+def test_irasa_median_method():
+    _, signal = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                 duration=60)
+    hset = np.arange(1.1, 1.9, 0.05)
+    _, psd_aperiodic, _, params = irasa(signal, sf=200, hset=hset)
+    for kwargs in [dict(median_method="p2"), dict(psd_dtype=np.float32)]:
+        _, psd_approx, _, params_approx = irasa(signal, sf=200, hset=hset,
+                                                **kwargs)
+        assert psd_approx.dtype == np.float64
+        assert np.median(np.abs(np.log10(psd_approx / psd_aperiodic))) < .01
+        assert np.allclose(params["Slope"], params_approx["Slope"], atol=.02)
+
+    # exact for up to five resampling factors
+    psd_p2 = irasa(signal, sf=200, hset=hset[:5], median_method="p2")[1]
+    assert np.allclose(psd_p2, irasa(signal, sf=200, hset=hset[:5])[1])
+
+
+# Test adaptive number of resampling factors
+def test_irasa_adaptive():
+    _, signal = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                 duration=60)
+    hset = np.arange(1.1, 1.9, 0.01)
+    *result, hset_used = irasa_adaptive(signal, sf=200, hset=hset, tol=0.05)
+    assert 5 <= len(hset_used) < len(hset)
+    assert np.isin(hset_used, np.round(hset, 4)).all()
+    assert hset_used.min() == 1.1 and hset_used.max() == 1.89
+
+    # without early stopping all factors are used
+    *result, hset_used = irasa_adaptive(signal, sf=200, hset=hset, tol=0)
+    expected = irasa(signal, sf=200, hset=hset, fit_method="lstsq")
+    assert len(hset_used) == len(hset)
+    for res, res_expected in zip(result[:3], expected[:3]):
+        assert np.allclose(res, res_expected)
+
+
+# Test sweeping hsets with shared resampling factors
+def test_irasa_sweep():
+    _, signal = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                 duration=60)
+    hsets = [np.arange(1.1, h_max, 0.1) for h_max in [1.5, 2, 3]]
+    results = irasa_sweep(signal, hsets, sf=200)
+    assert len(results) == len(hsets)
+    for hset, result in zip(hsets, results):
+        expected = irasa(signal, sf=200, hset=hset)
+        for res, res_expected in zip(result[:3], expected[:3]):
+            assert np.allclose(res, res_expected)
+        assert result[3].equals(expected[3])
+
+
+# Test processing channels in blocks
+def test_irasa_chunk_channels():
+    signals = [elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                duration=60, seed=seed)[1]
+               for seed in range(1, 6)]
+    data = np.array(signals)
+    expected = irasa(data, sf=200)
+    max_memory = 2 * 8 * data.shape[1] * (3 + 4 * 1.9)  # two channels
+    for kwargs in [dict(chunk_channels=2), dict(max_memory=max_memory)]:
+        result = irasa(data, sf=200, **kwargs)
+        for res, res_expected in zip(result[:3], expected[:3]):
+            assert np.array_equal(res, res_expected)
+        assert result[3].equals(expected[3])
+    with pytest.warns(UserWarning, match="single channel"):
+        irasa(data, sf=200, max_memory=1)
+
+
+# Test bad segment handling of MNE Raw data
+def test_irasa_reject_bad_segs():
+    sample_rate = 200
+    signals = [elec_phys_signal(1, [(10, 1, 2)], sample_rate=sample_rate,
+                                duration=60, seed=seed)[1]
+               for seed in range(1, 3)]
+    data = np.array(signals)
+    info = mne.create_info(['C3', 'C4'], sample_rate, 'eeg')
+    raw = mne.io.RawArray(data * 1e-6, info, verbose=False)
+    raw.set_annotations(mne.Annotations([0], [10], ['bad']))
+    good = slice(10 * sample_rate, None)
+
+    result = irasa(raw)
+    expected = irasa(data[:, good], sf=sample_rate)
+    for res, res_expected in zip(result[:3], expected[:3]):
+        assert np.allclose(res, res_expected)
+    result = irasa(raw, reject_bad_segs=False)
+    expected = irasa(data, sf=sample_rate)
+    for res, res_expected in zip(result[:3], expected[:3]):
+        assert np.allclose(res, res_expected)
+
+    # Good data on both sides of a bad segment is kept
+    raw.set_annotations(mne.Annotations([25], [10], ['bad']))
+    freqs, psd_aperiodic, psd_osc, fit_params = irasa(raw)
+    assert np.isfinite(psd_aperiodic).all()
+    assert np.isfinite(psd_osc).all()
+    expected = irasa(data, sf=sample_rate)
+    assert np.allclose(psd_aperiodic, expected[1], rtol=0.5)
+    psd_aperiodic = irasa(raw, band=(1, 20), decimate=True)[1]
+    assert np.isfinite(psd_aperiodic).all()
+
+    # NaN in a single channel only affect that channel, also in blocks
+    data = np.array([elec_phys_signal(1, [(10, 1, 2)], sample_rate=200,
+                                      duration=60, seed=seed)[1]
+                     for seed in range(1, 5)])
+    expected = irasa(data, sf=200)
+    data[0, 5000:5200] = np.nan
+    result = irasa(data, sf=200)
+    assert np.array_equal(result[1][1:], expected[1][1:])
+    assert np.allclose(result[1][0], expected[1][0], rtol=0.5)
+    chunked = irasa(data, sf=200, chunk_channels=2)
+    for res, res_chunked in zip(result[:3], chunked[:3]):
+        assert np.array_equal(res, res_chunked)
+
+
+# Test blockwise Welch PSD against scipy
+def test_calc_psd():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((3, 20000))
+    for average in ['mean', 'median']:
+        freqs, psd = calc_psd(data, 100, nperseg=400, average=average,
+                              block=7)
+        freqs_welch, psd_welch = welch(data, 100, nperseg=400,
+                                       average=average)
+        assert np.allclose(freqs, freqs_welch)
+        assert np.allclose(psd, psd_welch)
+    psd = calc_psd(data, 100, nperseg=400, average='median',
+                   median_method='p2')[1]
+    assert np.abs(np.log10(psd / psd_welch)).mean() < 0.05
+
+    # Segments with NaN are excluded
+    data[:, 5000:6000] = np.nan
+    for kwargs in [dict(average='mean'), dict(average='median'),
+                   dict(average='median', median_method='p2')]:
+        psd = calc_psd(data, 100, nperseg=400, **kwargs)[1]
+        assert np.isfinite(psd).all()
+    psd_spans = calc_psd([data[:, :5000], data[:, 6000:]], 100,
+                         nperseg=400)[1]
+    assert np.abs(np.log10(psd_spans / psd_welch)).mean() < 0.05
+
+    # Other Welch keywords
+    data = rng.standard_normal((3, 20000))
+
+    def detrend(x):
+        return x - x.mean(-1, keepdims=True)
+    for kwargs in [dict(nfft=512), dict(detrend=detrend),
+                   dict(detrend='linear', return_onesided=True)]:
+        freqs, psd = calc_psd(data, 100, nperseg=400, **kwargs)
+        freqs_welch, psd_welch = welch(data, 100, nperseg=400, **kwargs)
+        assert np.allclose(freqs, freqs_welch)
+        assert np.allclose(psd, psd_welch)
+    with pytest.raises(ValueError, match="return_onesided"):
+        calc_psd(data, 100, nperseg=400, return_onesided=False)
+    with pytest.raises(ValueError, match="padded"):
+        calc_psd(data, 100, nperseg=400, padded=True)
+
+
+# Test cached resampling plans
+def test_resample_plans():
+    hset = [1.1, 1.25, 1.9]
+    plans = resample_plans(hset)
+    assert resample_plans(hset) == plans
+    assert [plan.h for plan in plans] == hset
+    data = np.random.default_rng(0).standard_normal((2, 1000))
+    for plan in plans:
+        expected = resample_poly(data, plan.up, plan.down, axis=-1)
+        assert np.allclose(plan.resample(data), expected)
+        expected = resample_poly(data, plan.down, plan.up, axis=-1)
+        assert np.allclose(plan.resample(data, inverse=True), expected)
+
+    data = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200, duration=60,
+                            seed=1)[1]
+    expected = irasa(data, sf=200, hset=hset)
+    plans = [ResamplePlan(h) for h in hset]
+    result = irasa(data, sf=200, hset=plans)
+    for res, res_expected in zip(result[:3], expected[:3]):
+        assert np.array_equal(res, res_expected)
+    # The passed plans are used instead of the cached ones, only in that call
+    assert resample_plans(plans) == plans
+    scaled = ResamplePlan(1.25)
+    scaled.taps = 2 * scaled.taps
+    result = irasa(data, sf=200, hset=[plans[0], scaled, plans[2]])
+    assert not np.allclose(result[1], expected[1])
+    assert np.array_equal(irasa(data, sf=200, hset=hset)[1], expected[1])
+    slopes = irasa(data, sf=200, hset=plans, band=(1, 20))[3]["Slope"]
+    result = irasa(data, sf=200, hset=plans, band=(1, 20), decimate=True)
+    assert np.allclose(result[3]["Slope"], slopes, atol=1e-2)
+    result = irasa(data, sf=200, hset=[plans[0], 1.25, plans[2]])
+    for res, res_expected in zip(result[:3], expected[:3]):
+        assert np.array_equal(res, res_expected)
+    with pytest.raises(AssertionError):
+        irasa(data, sf=200, hset=plans[:1])
+
+
+# Test per-segment resampling engine
+def test_irasa_engine():
+    data = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200, duration=60,
+                            seed=1)[1]
+    expected = irasa(data, sf=200)
+    result = irasa(data, sf=200, engine='segment')
+    assert np.array_equal(result[0], expected[0])
+    assert np.abs(np.log10(result[1] / expected[1])).mean() < 0.05
+    assert np.allclose(result[3]["Slope"], expected[3]["Slope"], atol=0.1)
+    with pytest.raises(ValueError, match="average='mean'"):
+        irasa(data, sf=200, engine='segment',
+              kwargs_welch=dict(average='median', window='hann'))
+    with pytest.raises(ValueError, match="engine"):
+        irasa(data, sf=200, engine='fft')
+
+    # Segments lost to NaN are counted separately for h and 1/h
+    data_nan = data.copy()
+    data_nan[6000:6010] = np.nan
+    result = irasa(data_nan, sf=200, engine='segment', reject_bad_segs=False)
+    assert np.isfinite(result[1]).all()
+    assert np.abs(np.log10(result[1] / expected[1])).mean() < 0.05
+
+
+# Test resampling backends
+def test_irasa_resampler():
+    data = np.random.default_rng(0).standard_normal((2, 1001))
+    fft_resampler = _FFTResampler(data)
+    for h in resample_plans([1.1, 1.25, 1.9]):
+        for up, down, inverse in [(h.up, h.down, False),
+                                  (h.down, h.up, True)]:
+            num = -(-data.shape[-1] * up // down)
+            expected = resample(data, num, axis=-1)
+            result = fft_resampler.resample(h.ratio, inverse)
+            assert np.allclose(result, expected)
+
+    data = elec_phys_signal(1, [(10, 1, 2)], sample_rate=200, duration=60,
+                            seed=1)[1]
+    expected = irasa(data, sf=200)
+    for resampler in ['fft', 'auto']:
+        result = irasa(data, sf=200, resampler=resampler)
+        assert np.array_equal(result[0], expected[0])
+        assert np.abs(np.log10(result[1] / expected[1])).mean() < 0.05
+        assert np.allclose(result[3]["Slope"], expected[3]["Slope"],
+                           atol=0.1)
+    with pytest.raises(ValueError, match="resampler"):
+        irasa(data, sf=200, resampler='sinc')
+    with pytest.raises(ValueError, match="resampler='poly'"):
+        irasa(data, sf=200, engine='segment', resampler='fft')
+
+
+# Test batched simulation
+def test_elec_phys_signals():
+    params = dict(sample_rate=200, duration=10, highpass=True)
+    periodic_params = [[(10, 1, 2)], None, [(5, 1, 1), (20, 2, 3)]]
+    aperiodic, full = elec_phys_signals([1, 1.5, 2], periodic_params,
+                                        nlv=[0, 1e-5, 0], seeds=[1, 2, 3],
+                                        **params)
+    assert aperiodic.shape == full.shape == (3, 2000 - 2)
+    for i, (exponent, nlv, seed) in enumerate([(1, 0, 1), (1.5, 1e-5, 2),
+                                               (2, 0, 3)]):
+        expected = elec_phys_signal(exponent, periodic_params[i], nlv,
+                                    seed=seed, **params)
+        assert np.allclose(aperiodic[i], expected[0])
+        assert np.allclose(full[i], expected[1])
+
+    # shared oscillations and float32 output
+    aperiodic, full = elec_phys_signals(1, [(10, 1, 2)], seeds=[1, 2],
+                                        dtype=np.float32, **params)
+    assert full.dtype == np.float32 and full.shape[0] == 2
+    expected = elec_phys_signal(1, [(10, 1, 2)], seed=2, **params)[1]
+    assert np.allclose(full[1], expected, rtol=1e-3,
+                       atol=1e-4 * np.abs(expected).max())
+
+
+# Test independent random streams
+def test_simulate_signals():
+    param_sets = [dict(exponent=exponent, periodic_params=[(10, 1, 2)],
+                       nlv=1e-5, sample_rate=200, duration=10)
+                  for exponent in [1, 1.5, 2, 2.5]]
+    state = np.random.get_state()[1].copy()
+    serial = simulate_signals(param_sets, seed=5)
+    parallel = simulate_signals(param_sets, seed=5, n_jobs=3)
+    assert np.array_equal(np.random.get_state()[1], state)
+    for res_serial, res_parallel in zip(serial, parallel):
+        assert np.array_equal(res_serial[0], res_parallel[0])
+        assert np.array_equal(res_serial[1], res_parallel[1])
+    assert not np.allclose(serial[0][0], serial[1][0])
+
+    # same streams in the batched simulation
+    aperiodic, full = elec_phys_signals(
+        [1, 1.5, 2, 2.5], [(10, 1, 2)], nlv=1e-5, sample_rate=200,
+        duration=10, seeds=np.random.SeedSequence(5))
+    for i, (res_aperiodic, res_full) in enumerate(serial):
+        assert np.allclose(aperiodic[i], res_aperiodic)
+        assert np.allclose(full[i], res_full)
+    with pytest.raises(AssertionError, match="seed"):
+        simulate_signals([dict(exponent=1, seed=1)])
+
+
+# Test analytic expected PSD
+def test_elec_phys_psd():
+    params = dict(periodic_params=[(10, 1, 2)], nlv=1e-4, sample_rate=200,
+                  duration=60)
+    freqs, psd_aperiodic, psd_full = elec_phys_psd(1.5, **params,
+                                                   nperseg=200)
+    signals = elec_phys_signals(1.5, seeds=np.arange(1, 11), **params)
+    for psd, signal in zip([psd_aperiodic, psd_full], signals):
+        freqs_welch, psd_welch = welch(signal, 200, nperseg=200)
+        assert np.array_equal(freqs, freqs_welch)
+        mask = (freqs >= 2) & (freqs <= 80)
+        error = np.log10(psd[mask] / psd_welch.mean(axis=0)[mask])
+        assert np.abs(error).mean() < 0.05
+
+    # sampling noise
+    noisy = elec_phys_psd(1.5, **params, nperseg=200, sampling_noise=True,
+                          rng=0)
+    assert np.array_equal(noisy[1], elec_phys_psd(
+        1.5, **params, nperseg=200, sampling_noise=True, rng=0)[1])
+    assert not np.allclose(noisy[1], psd_aperiodic)
+    assert np.allclose(noisy[2] / psd_full, noisy[1] / psd_aperiodic)
+    assert np.abs(np.log10(noisy[1] / psd_aperiodic)).mean() < 0.1
+
+
+# Test vectorized peaks
+def test_peak_spectrum():
+    freqs = np.fft.rfftfreq(2400 * 10, d=1 / 2400)[1:]
+    periodic_params = [(10 * k, 1 / k, 0.5 + 0.1 * k) for k in range(1, 60)]
+    periodic_params += [(0.5, 1, 1), (1199, 1, 2)]  # peaks at the edges
+    expected = sum(amp * norm(freq, width).pdf(freqs)
+                   for freq, amp, width in periodic_params)
+    result = _peak_spectrum(periodic_params, freqs)
+    assert np.allclose(result, expected, rtol=0, atol=1e-7 * expected.max())
+
+
+# Test frequency-domain highpass
+def test_elec_phys_signal_highpass_fft():
+    params = dict(periodic_params=[(10, 1, 2)], nlv=1e-4, highpass=True,
+                  sample_rate=200, duration=60)
+    expected = elec_phys_signal(1, **params)
+    result = elec_phys_signal(1, **params, highpass_method='fft')
+    batched = elec_phys_signals(1, **params, seeds=[1],
+                                highpass_method='fft')
+    # The filter transient decays within the first seconds
+    for res, res_batched, res_expected in zip(result, batched, expected):
+        atol = 1e-6 * np.abs(res_expected).max()
+        assert np.allclose(res[2000:], res_expected[2000:], atol=atol)
+        assert np.allclose(res_batched[0], res, atol=atol)
+
+    # without oscillations, both signals are identical
+    aperiodic_signal, full_signal = elec_phys_signal(1, highpass=True,
+                                                     highpass_method='fft')
+    assert np.array_equal(aperiodic_signal, full_signal)
+    assert full_signal is not aperiodic_signal
+    with pytest.raises(ValueError, match="highpass_method"):
+        elec_phys_signal(1, highpass=True, highpass_method='filtfilt')
+
+
+# Test chunked simulation into a memory map
+def test_simulate_to_npy(tmp_path):
+    params = dict(exponent=1.5, periodic_params=[(10, 1, 2)], nlv=1e-4,
+                  sample_rate=200, duration=120)
+    signals = simulate_to_npy(tmp_path / "sim.npy", **params, n_channels=4,
+                              block_sec=10, seed=1)
+    assert signals.shape == (4, 24000) and signals.dtype == np.float32
+    assert np.array_equal(np.load(tmp_path / "sim.npy"), signals)
+    again = simulate_to_npy(tmp_path / "again.npy", **params, n_channels=4,
+                            block_sec=10, seed=1)
+    assert np.array_equal(again, signals)
+
+    # PSD of elec_phys_signal with the same duration
+    freqs, psd = welch(signals, 200, nperseg=200)
+    psd_expected = elec_phys_psd(**params, nperseg=200)[2]
+    mask = (freqs >= 1) & (freqs <= 80)
+    error = np.log10(psd.mean(axis=0)[mask] / psd_expected[mask])
+    assert np.abs(error).mean() < 0.05
+
+
+# Test vectorized plateau detection
+def test_detect_plateau_onset_slope():
+    freq = np.arange(0, 600.25, 0.25)
+    psd = np.r_[1, freq[1:] ** -2.0 + 1e-3]
+    starts = _plateau_starts(freq, 1, 50, 1)
+    assert starts[0] == 2 and starts[-1] + 50 <= freq[-1]
+    exponents = _plateau_exponents(freq, psd, starts, 50)
+    for i in [0, 100, len(starts) - 1]:
+        mask = (freq >= starts[i]) & (freq <= starts[i] + 50)
+        expected = -np.polyfit(np.log10(freq[mask]), np.log10(psd[mask]),
+                               1)[0]
+        assert np.isclose(exponents[i], expected)
+
+    # peaks are excluded by the robust variant
+    peak = 1e-2 * np.exp(-0.5 * ((freq - 150) / 1)**2)
+    exponents_peak = _plateau_exponents(freq, psd + peak, starts, 50,
+                                        robust=True)
+    at_peak = np.flatnonzero(starts == 120)[0]
+    assert (abs(exponents_peak[at_peak] - exponents[at_peak])
+            < abs(_plateau_exponents(freq, psd + peak, starts, 50)[at_peak]
+                  - exponents[at_peak]))
+
+    onset_fooof = detect_plateau_onset(freq, psd, 1)
+    for method in ['slope', 'slope_robust']:
+        onset = detect_plateau_onset(freq, psd, 1, method=method)
+        assert abs(onset - onset_fooof) <= 5
+    assert (detect_plateau_onset(freq, psd, 500, reverse=True, method='slope')
+            == detect_plateau_onset(freq, psd, 500, reverse=True))
+    # a zero DC bin does not spread into the later windows
+    psd_dc = np.r_[0, psd[1:]]
+    for method in ['slope', 'slope_robust']:
+        assert np.isfinite(_plateau_exponents(freq, psd_dc, starts, 50,
+                                              robust=method != 'slope')).all()
+        onset = detect_plateau_onset(freq, psd_dc, 1, method=method)
+        assert abs(onset - onset_fooof) <= 5
+    with pytest.raises(ValueError, match="plateau"):
+        detect_plateau_onset(freq[1:], freq[1:] ** -2.0, 1, method='slope')
+
+
+# Test coarse-to-fine plateau search
+def test_detect_plateau_onset_coarse_to_fine():
+    freq = np.arange(0.25, 600.25, 0.25)
+    psd = freq ** -2.0 + 1e-3
+    onset, n_fits = detect_plateau_onset(freq, psd, 1, return_n_fits=True)
+    onset_coarse, n_fits_coarse = detect_plateau_onset(
+        freq, psd, 1, search='coarse_to_fine', return_n_fits=True)
+    assert onset_coarse == onset
+    assert n_fits == onset - 25 - 1
+    assert n_fits_coarse < n_fits / 2
+    assert detect_plateau_onset(freq, psd, 1, search='coarse_to_fine',
+                                coarse_step=3) == onset
+    with pytest.raises(ValueError, match="search"):
+        detect_plateau_onset(freq, psd, 1, search='bisect')
+
+    # noisy simulated spectrum with line noise, also starting on the plateau.
+    # Its exponent dips below thresh for 5 positions before the plateau.
+    _, signal = elec_phys_signal(2, [(10, 1, 2), (50, 0.05, 0.5)],
+                                 nlv=2e-4, sample_rate=2400)
+    freq, psd = welch(signal, fs=2400, nperseg=4 * 2400)
+    for f_start in [1, 50]:
+        onset, n_fits = detect_plateau_onset(freq, psd, f_start,
+                                             return_n_fits=True)
+        onset_coarse, n_fits_coarse = detect_plateau_onset(
+            freq, psd, f_start, search='coarse_to_fine', coarse_step=5,
+            return_n_fits=True)
+        assert onset_coarse == onset
+        assert n_fits_coarse <= n_fits
+    assert n_fits_coarse == 1
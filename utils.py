@@ -1,4 +1,13 @@
 import fractions
+import glob
+import hashlib
+import math
+import os
+import time
+import warnings
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import List, Tuple
 
 import mne
@@ -6,14 +15,10 @@ import numpy as np
 import pandas as pd
 import scipy as sp
 import scipy.signal as sig
+from scipy.fft import rfft
 from fooof import FOOOF
 from numpy.fft import irfft, rfftfreq
 
-try:
-    from tqdm import trange
-except ImportError:
-    trange = range
-
 
 def elec_phys_signal(exponent: float,
                      periodic_params: List[Tuple[float, float, float]] = None,
@@ -21,7 +26,9 @@ def elec_phys_signal(exponent: float,
                      highpass: bool = False,
                      sample_rate: float = 2400,
                      duration: float = 180,
-                     seed: int = 1):
+                     seed: int = 1,
+                     rng: np.random.Generator = None,
+                     highpass_method: str = 'sosfilt'):
     """
     Generate 1/f noise with optionally added oscillations.
 
@@ -45,6 +52,17 @@ def elec_phys_signal(exponent: float,
         Duration of the signal in seconds. The default is 180s.
     seed : int, optional
         Seed for reproducability. The default is 1.
+    rng : :py:class:`numpy.random.Generator`, optional
+        Random generator used instead of the global random state. If given,
+        ``seed`` is ignored and the global random state is not touched, so
+        that signals can be generated concurrently, see
+        :py:func:`simulate_signals`. The default is None.
+    highpass_method : str, optional
+        'sosfilt' (default) filters the signals in the time domain. 'fft'
+        multiplies the complex amplitudes by the frequency response of the
+        filter before the inverse FFT, which is faster. The filtering is then
+        circular: it matches 'sosfilt' except for the transient of the
+        filter in the first seconds of the signal.
 
     Returns
     -------
@@ -53,54 +71,528 @@ def elec_phys_signal(exponent: float,
     full_signal : ndarray
         Aperiodic 1/f activitiy with added oscillations.
     """
-    if seed:
-        np.random.seed(seed)
+    _check_highpass_method(highpass_method)
+    if rng is None:
+        if seed:
+            np.random.seed(seed)
+        rng = np.random
     # Initialize
     n_samples = int(duration * sample_rate)
-    amps = np.ones(n_samples//2, complex)
     freqs = rfftfreq(n_samples, d=1/sample_rate)
     freqs = freqs[1:]  # avoid divison by 0
+    amps, amps_osc = _signal_amplitudes(exponent, periodic_params, freqs,
+                                        rng)
+    # White noise, drawn after the phases
+    w_noise = rng.normal(scale=nlv, size=n_samples-2) if nlv else 0
+
+    if highpass and highpass_method == 'fft':
+        # Add the white noise to the amplitudes and apply the frequency
+        # response of the filter
+        w_amps = rfft(w_noise) if nlv else 0
+        response = _highpass_response(n_samples - 2, sample_rate)
+        amps = (amps + w_amps) * response
+        amps_osc = (amps_osc + w_amps) * response
+        w_noise = 0
+
+    # Create colored noise time series from amplitudes. Without
+    # oscillations, both signals are identical.
+    aperiodic_signal = irfft(amps) + w_noise
+    if periodic_params:
+        full_signal = irfft(amps_osc) + w_noise
+
+    # Highpass filter
+    if highpass and highpass_method == 'sosfilt':
+        sos = sig.butter(4, 1, btype="hp", fs=sample_rate, output='sos')
+        aperiodic_signal = sig.sosfilt(sos, aperiodic_signal)
+        if periodic_params:
+            full_signal = sig.sosfilt(sos, full_signal)
+
+    if not periodic_params:
+        full_signal = aperiodic_signal.copy()
+    return aperiodic_signal, full_signal
+
+
+def elec_phys_signals(exponents,
+                      periodic_params=None,
+                      nlv=None,
+                      highpass: bool = False,
+                      sample_rate: float = 2400,
+                      duration: float = 180,
+                      seeds=1,
+                      dtype=np.float64,
+                      highpass_method: str = 'sosfilt'):
+    """
+    Generate several 1/f noise signals with optionally added oscillations.
+
+    The amplitude spectra of all signals are stacked into one matrix and
+    transformed with a single batched inverse FFT. Up to floating point
+    rounding, row i equals ``elec_phys_signal(exponents[i],
+    periodic_params[i], nlv[i], highpass, sample_rate, duration,
+    seeds[i])``.
+
+    Parameters
+    ----------
+    exponents : float or array_like
+        Aperiodic 1/f exponent of each signal.
+    periodic_params : list of tuples or list of lists of tuples, optional
+        Oscillation parameters as in :py:func:`elec_phys_signal`, either
+        shared by all signals, e.g. [(10, 1, 2)], or one list per signal,
+        e.g. [[(10, 1, 2)], [(10, 2, 2)], None]. The default is None.
+    nlv : float or array_like, optional
+        Level of white noise of each signal. The default is None.
+    highpass : bool, optional
+        Whether to apply a 4th order butterworth highpass filter at 1Hz.
+        The default is False.
+    sample_rate : float, optional
+        Sample rate of the signals. The default is 2400Hz.
+    duration : float, optional
+        Duration of the signals in seconds. The default is 180s.
+    seeds : int, array_like or :py:class:`numpy.random.SeedSequence`
+        Seed of each signal. As in :py:func:`elec_phys_signal`, a seed of 0
+        draws from the global random state. If a SeedSequence is given, an
+        independent :py:class:`numpy.random.Generator` is spawned for each
+        signal. The default is 1.
+    dtype : dtype, optional
+        Data type of the signals. ``np.float32`` halves the memory of the
+        amplitude matrix and of the output. The default is ``np.float64``.
+    highpass_method : str, optional
+        See :py:func:`elec_phys_signal`. The default is 'sosfilt'.
+
+    Returns
+    -------
+    aperiodic_signals : ndarray
+        Aperiodic 1/f activitiy without oscillations, of shape
+        (n_signals, n_samples - 2).
+    full_signals : ndarray
+        Aperiodic 1/f activitiy with added oscillations.
+    """
+    _check_highpass_method(highpass_method)
+    if isinstance(seeds, np.random.SeedSequence):
+        seed_seq, seeds = seeds, 1
+    else:
+        seed_seq = None
+    exponents, nlvs, seeds = np.broadcast_arrays(
+        np.atleast_1d(exponents), 0 if nlv is None else nlv, seeds)
+    n_signals = exponents.size
+    if seed_seq is not None:
+        rngs = [np.random.default_rng(child)
+                for child in seed_seq.spawn(n_signals)]
+    else:
+        rngs = [np.random.RandomState(seed) if seed else np.random
+                for seed in seeds]
+    periodic_params = _per_signal_params(periodic_params, n_signals)
+    complex_dtype = np.result_type(dtype, np.complex64)
+
+    n_samples = int(duration * sample_rate)
+    freqs = rfftfreq(n_samples, d=1/sample_rate)
+    freqs = freqs[1:]  # avoid divison by 0
+    amps = np.empty((n_signals, freqs.size), complex_dtype)
+    amps_osc = np.empty_like(amps)
+    for i, rng in enumerate(rngs):
+        amps[i], amps_osc[i] = _signal_amplitudes(
+            exponents[i], periodic_params[i], freqs, rng)
+
+    has_osc = any(periodic_params)
+    if highpass and highpass_method == 'fft':
+        # Add the white noise to the amplitudes and apply the frequency
+        # response of the filter
+        for i, rng in enumerate(rngs):
+            if nlvs[i]:
+                w_amps = rfft(rng.normal(scale=nlvs[i], size=n_samples-2))
+                amps[i] += w_amps
+                amps_osc[i] += w_amps
+        response = _highpass_response(n_samples - 2, sample_rate)
+        amps *= response
+        amps_osc *= response
+
+    # Create colored noise time series from amplitudes
+    aperiodic_signals = sp.fft.irfft(amps, axis=-1)
+    if has_osc:
+        full_signals = sp.fft.irfft(amps_osc, axis=-1)
+    del amps, amps_osc
+
+    if not (highpass and highpass_method == 'fft'):
+        # Add white noise, drawn after the phases as in elec_phys_signal
+        for i, rng in enumerate(rngs):
+            if nlvs[i]:
+                w_noise = rng.normal(scale=nlvs[i], size=n_samples-2)
+                aperiodic_signals[i] += w_noise
+                if has_osc:
+                    full_signals[i] += w_noise
+
+    # Highpass filter
+    if highpass and highpass_method == 'sosfilt':
+        sos = sig.butter(4, 1, btype="hp", fs=sample_rate, output='sos')
+        aperiodic_signals = sig.sosfilt(sos, aperiodic_signals, axis=-1)
+        if has_osc:
+            full_signals = sig.sosfilt(sos, full_signals, axis=-1)
+
+    if not has_osc:
+        full_signals = aperiodic_signals.copy()
+    return (aperiodic_signals.astype(dtype, copy=False),
+            full_signals.astype(dtype, copy=False))
+
+
+def simulate_signals(param_sets, seed=None, n_jobs=1, executor=None):
+    """
+    Generate signals with :py:func:`elec_phys_signal` on a pool of workers.
+
+    Each signal gets its own :py:class:`numpy.random.Generator`, spawned
+    from ``seed`` by its position in ``param_sets``. The results are
+    therefore bit-identical for any number of workers and do not depend on
+    or change the global random state.
+
+    Parameters
+    ----------
+    param_sets : list of dict
+        Keyword arguments of :py:func:`elec_phys_signal` for each signal,
+        e.g. [dict(exponent=1), dict(exponent=2, nlv=0.1)]. ``seed`` and
+        ``rng`` are not allowed.
+    seed : int or :py:class:`numpy.random.SeedSequence`, optional
+        Root seed of the random streams. If None, fresh entropy from the
+        operating system is used. The default is None.
+    n_jobs : int or None, optional
+        Number of threads. 1 (default) runs serially, -1 uses all CPUs.
+    executor : :py:class:`concurrent.futures.Executor`, optional
+        Pool used instead of a thread pool, e.g. a
+        :py:class:`concurrent.futures.ProcessPoolExecutor`. If given,
+        ``n_jobs`` is ignored. The default is None.
+
+    Returns
+    -------
+    signals : list of tuples
+        (aperiodic_signal, full_signal) for each parameter set.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    for params in param_sets:
+        assert not {'seed', 'rng'} & set(params), \
+            'param_sets must not contain seed or rng.'
+    tasks = list(zip(param_sets, seed.spawn(len(param_sets))))
+    return list(_map(_simulate_signal, tasks, n_jobs, executor))
+
+
+def _simulate_signal(task):
+    """Run elec_phys_signal with the generator of a child SeedSequence."""
+    params, seed_seq = task
+    return elec_phys_signal(**params, rng=np.random.default_rng(seed_seq))
+
+
+def _check_highpass_method(highpass_method):
+    """Raise a ValueError if highpass_method is unknown."""
+    if highpass_method not in ('sosfilt', 'fft'):
+        raise ValueError("highpass_method must be 'sosfilt' or 'fft', "
+                         f"got {highpass_method!r}.")
+
+
+def _highpass_response(n_times, sample_rate):
+    """Response of the 1Hz highpass filter at the rfft frequencies."""
+    sos = sig.butter(4, 1, btype="hp", fs=sample_rate, output='sos')
+    return sig.sosfreqz(sos, rfftfreq(n_times, d=1/sample_rate),
+                        fs=sample_rate)[1]
+
+
+def _per_signal_params(periodic_params, n_signals):
+    """Return one list of oscillation parameters per signal."""
+    if not periodic_params:
+        return [None] * n_signals
+    if np.ndim(periodic_params[0]) == 1 and len(periodic_params[0]) == 3:
+        return [periodic_params] * n_signals
+    assert len(periodic_params) == n_signals, \
+        'periodic_params must be shared or given for each signal.'
+    return list(periodic_params)
+
+
+def _signal_amplitudes(exponent, periodic_params, freqs, rng):
+    """
+    Return the complex amplitudes without and with oscillations.
+
+    The random phases are drawn from rng, which is a
+    :py:class:`numpy.random.Generator`, a
+    :py:class:`numpy.random.RandomState`, or the :py:mod:`numpy.random`
+    module for the global random state.
+    """
+    amps = np.ones(freqs.size, complex)
 
     # Create random phases
-    rand_dist = np.random.uniform(0, 2*np.pi, size=amps.shape)
+    rand_dist = rng.uniform(0, 2*np.pi, size=amps.shape)
     rand_phases = np.exp(1j * rand_dist)
 
     # Multiply phases to amplitudes and create power law
     amps *= rand_phases
     amps /= freqs ** (exponent / 2)
 
-    # Add oscillations
+    # Add oscillations with the same random phases
     amps_osc = amps.copy()
     if periodic_params:
-        for osc_params in periodic_params:
-            freq_osc, amp_osc, width = osc_params
-            amp_dist = sp.stats.norm(freq_osc, width).pdf(freqs)
-            # add same random phases
-            amp_dist = amp_dist * rand_phases
-            amps_osc += amp_osc * amp_dist
+        amps_osc += _peak_spectrum(periodic_params, freqs) * rand_phases
+    return amps, amps_osc
 
-    # Create colored noise time series from amplitudes
-    aperiodic_signal = irfft(amps)
-    full_signal = irfft(amps_osc)
 
-    # Add white noise
+def _peak_spectrum(periodic_params, freqs, n_widths=6):
+    """
+    Sum of the Gaussian peaks amp * norm(freq, width).pdf(freqs).
+
+    All peaks are evaluated at once, each only at the evenly spaced freqs
+    within n_widths widths of its center. Beyond 6 widths, the Gaussian is
+    below 1e-8 of its maximum.
+    """
+    centers, amps, widths = np.asarray(periodic_params,
+                                       float).reshape(-1, 3).T
+    df = freqs[1] - freqs[0]
+    half = int(np.ceil(n_widths * widths.max() / df))
+    bins = (np.round((centers - freqs[0]) / df).astype(int)[:, None]
+            + np.arange(-half, half + 1))
+    inside = (bins >= 0) & (bins < freqs.size)
+    bins = bins[inside]
+    peak = np.nonzero(inside)[0]
+    z = (freqs[bins] - centers[peak]) / widths[peak]
+    near = np.abs(z) <= n_widths
+    values = (amps[peak] * np.exp(-0.5 * z**2)
+              / (np.sqrt(2 * np.pi) * widths[peak]))
+    return np.bincount(bins[near], weights=values[near],
+                       minlength=freqs.size)
+
+
+def elec_phys_psd(exponent: float,
+                  periodic_params: List[Tuple[float, float, float]] = None,
+                  nlv: float = None,
+                  highpass: bool = False,
+                  sample_rate: float = 2400,
+                  duration: float = 180,
+                  nperseg: int = None,
+                  noverlap: int = None,
+                  window='hann',
+                  detrend='constant',
+                  sampling_noise: bool = False,
+                  rng=None):
+    """
+    Expected Welch PSD of the signals of :py:func:`elec_phys_signal`.
+
+    The signals are not synthesized. Their autocovariance follows from the
+    power of the amplitude spectrum, because the phases are random. The
+    expected periodogram of a detrended and windowed segment is computed
+    from the autocovariance at the lags within one segment. This is exact
+    for ``sig.welch(signal, sample_rate, window, nperseg, noverlap,
+    detrend=detrend)`` with ``average='mean'``, averaged over seeds.
+    Only the transient of the highpass filter at the start of the signal
+    is neglected, as with ``highpass_method='fft'``.
+
+    Parameters
+    ----------
+    exponent, periodic_params, nlv, highpass, sample_rate, duration
+        See :py:func:`elec_phys_signal`.
+    nperseg : int, optional
+        Length of the Welch segments. The default is one second.
+    noverlap : int, optional
+        Overlap of the Welch segments. The default is ``nperseg // 2``.
+    window : str or tuple, optional
+        Window of the Welch segments. The default is 'hann'.
+    detrend : 'constant' or False, optional
+        Detrending of the Welch segments. The default is 'constant'.
+    sampling_noise : bool, optional
+        If True, multiply the expected PSDs by chi-square distributed noise
+        with the equivalent degrees of freedom of Welch's method for the
+        number, overlap, and window of the segments. The same noise is
+        applied to both PSDs, as they share the phases. The default is
+        False.
+    rng : :py:class:`numpy.random.Generator` or int, optional
+        Random generator or seed of the sampling noise. The default is None.
+
+    Returns
+    -------
+    freqs : ndarray
+        Frequencies of the Welch PSD.
+    psd_aperiodic : ndarray
+        Expected PSD of the aperiodic signal.
+    psd_full : ndarray
+        Expected PSD of the signal with oscillations.
+    """
+    n_samples = int(duration * sample_rate)
+    freqs = rfftfreq(n_samples, d=1/sample_rate)
+    freqs = freqs[1:]  # avoid divison by 0
+    n_times = 2 * (freqs.size - 1)  # length of the signals
+    nperseg = int(sample_rate) if nperseg is None else nperseg
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    assert nperseg <= n_times, 'nperseg must not exceed the signal length.'
+    assert detrend in ('constant', False), \
+        "detrend must be 'constant' or False."
+
+    # Power of the irfft bins. Only the real part of the random phase is
+    # kept at DC and Nyquist.
+    amps = freqs ** -(exponent / 2)
+    amps_osc = amps.copy()
+    if periodic_params:
+        amps_osc += _peak_spectrum(periodic_params, freqs)
+    power = np.abs(np.stack([amps, amps_osc]))**2
+    power[:, [0, -1]] /= 2
     if nlv:
-        w_noise = np.random.normal(scale=nlv, size=n_samples-2)
-        aperiodic_signal += w_noise
-        full_signal += w_noise
+        power += n_times * nlv**2
+    if highpass:
+        power *= np.abs(_highpass_response(n_times, sample_rate))**2
 
-    # Highpass filter
+    # Autocovariance at the lags -(nperseg - 1) ... nperseg - 1
+    acov = sp.fft.irfft(power, n_times, axis=-1) / n_times
+    acov = np.concatenate([acov[:, nperseg - 1:0:-1], acov[:, :nperseg]],
+                          axis=-1)
+    win = sig.get_window(window, nperseg)
+    psds = _expected_periodogram(acov, win, detrend)
+    scale = 1.0 / (sample_rate * (win * win).sum())
+    psds *= scale
+    if nperseg % 2:
+        psds[:, 1:] *= 2
+    else:
+        psds[:, 1:-1] *= 2
+
+    if sampling_noise:
+        dof = _welch_dof(win, n_times, nperseg - noverlap)
+        rng = np.random.default_rng(rng)
+        psds *= rng.chisquare(dof, size=psds.shape[-1]) / dof
+    return rfftfreq(nperseg, d=1/sample_rate), psds[0], psds[1]
+
+
+def _expected_periodogram(acov, win, detrend='constant'):
+    """
+    Expected |rfft(win * detrend(segment))|**2 from the autocovariance.
+
+    acov holds the autocovariance at the lags -(n - 1) ... n - 1 along the
+    last axis, where n is the segment length.
+    """
+    nperseg = win.size
+    # Windowed autocovariance, folded to the lags 0 ... n - 1 of the DFT
+    lagged = acov * np.correlate(win, win, 'full')
+    folded = lagged[..., nperseg - 1:].copy()
+    folded[..., 1:] += lagged[..., :nperseg - 1]
+    expected = rfft(folded, axis=-1).real
+    if detrend == 'constant':
+        # Row sums of the covariance matrix of the segment
+        cumsum = np.cumsum(np.pad(acov, [(0, 0)] * (acov.ndim - 1) + [(1, 0)]),
+                           axis=-1)
+        row_sums = cumsum[..., nperseg:] - cumsum[..., :nperseg]
+        win_fft = rfft(win)
+        expected -= 2 / nperseg * np.real(rfft(win * row_sums, axis=-1)
+                                          * np.conj(win_fft))
+        expected += (row_sums.sum(axis=-1, keepdims=True) / nperseg**2
+                     * np.abs(win_fft)**2)
+    return expected
+
+
+def _welch_dof(win, n_times, step):
+    """Equivalent degrees of freedom of Welch's method (Welch, 1967)."""
+    nperseg = win.size
+    n_segments = (n_times - nperseg) // step + 1
+    win_acf = np.correlate(win, win, 'full')[nperseg - 1:]
+    shifts = np.arange(1, n_segments)
+    shifts = shifts[shifts * step < nperseg]
+    corr = win_acf[shifts * step] / win_acf[0]
+    variance = (1 + 2 * np.sum((1 - shifts / n_segments) * corr**2)) \
+        / n_segments
+    return 2 / variance
+
+
+def simulate_to_npy(path,
+                    exponent: float,
+                    periodic_params: List[Tuple[float, float, float]] = None,
+                    nlv: float = None,
+                    highpass: bool = False,
+                    sample_rate: float = 2400,
+                    duration: float = 3600,
+                    n_channels: int = 1,
+                    block_sec: float = 60,
+                    seed=None,
+                    dtype=np.float32):
+    """
+    Simulate long multi-channel signals into a memory-mapped .npy file.
+
+    The signals are synthesized by overlap-add of blocks of spectrally
+    shaped noise, so memory is bounded by the block length rather than the
+    duration. Each block has the amplitude spectrum of
+    :py:func:`elec_phys_signal` with random phases and is tapered with a
+    sine window at 50% overlap, whose squares sum to one. The blocks are
+    independent, so the signals are stationary and have the PSD of
+    ``elec_phys_signal(duration=duration)``, smoothed over about
+    ``1 / block_sec``. Frequencies below ``2 / block_sec`` are not
+    represented. White noise and the highpass filter are applied to
+    consecutive chunks, the filter state is carried across chunks.
+
+    The file can be read with :py:func:`irasa_stream`.
+
+    Parameters
+    ----------
+    path : str or path-like
+        Path of the .npy file. The data has shape (n_channels, n_samples).
+    exponent, periodic_params, nlv, highpass, sample_rate, duration
+        See :py:func:`elec_phys_signal`. The default duration is one hour.
+    n_channels : int, optional
+        Number of independent channels. The default is 1.
+    block_sec : float, optional
+        Length of the synthesized blocks in seconds. The default is 60.
+    seed : int or :py:class:`numpy.random.SeedSequence`, optional
+        Root seed. Each block draws from its own stream spawned from it, so
+        the file is reproducible. With the same seed, the signal without
+        ``periodic_params`` is the aperiodic component of the signal with
+        them. The default is None (fresh entropy).
+    dtype : dtype, optional
+        Data type of the file. The default is ``np.float32``.
+
+    Returns
+    -------
+    signals : :py:class:`numpy.memmap`
+        Memory map of the file.
+    """
+    n_times = int(duration * sample_rate)
+    block = 2 * int(block_sec * sample_rate / 2)
+    hop = block // 2
+    assert 0 < block <= n_times, \
+        'block_sec must be positive and shorter than duration.'
+
+    # Amplitudes of a block, scaled to the PSD level of the whole signal
+    freqs = rfftfreq(block, d=1/sample_rate)
+    amps = np.zeros(freqs.size)
+    amps[1:] = freqs[1:] ** -(exponent / 2)
+    if periodic_params:
+        amps[1:] += _peak_spectrum(periodic_params, freqs[1:])
+    amps *= np.sqrt(block / n_times)
+    window = np.sin(np.pi * (np.arange(block) + 0.5) / block)
+
+    def block_signal(rng):
+        phases = np.exp(2j * np.pi * rng.random((n_channels, freqs.size)))
+        return sp.fft.irfft(amps * phases, block, axis=-1) * window
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    n_chunks = -(-n_times // hop)
+    seed_seqs = seed.spawn(n_chunks + 1)
     if highpass:
         sos = sig.butter(4, 1, btype="hp", fs=sample_rate, output='sos')
-        aperiodic_signal = sig.sosfilt(sos, aperiodic_signal)
-        full_signal = sig.sosfilt(sos, full_signal)
+        zi = np.zeros((sos.shape[0], n_channels, 2))
+    signals = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                        shape=(n_channels, n_times))
 
-    return aperiodic_signal, full_signal
+    # Each chunk of hop samples is the second half of the previous block
+    # plus the first half of the next
+    tail = block_signal(np.random.default_rng(seed_seqs[0]))[:, hop:]
+    for i in range(n_chunks):
+        rng = np.random.default_rng(seed_seqs[i + 1])
+        current = block_signal(rng)
+        chunk = tail + current[:, :hop]
+        tail = current[:, hop:]
+        if nlv:
+            chunk += rng.normal(scale=nlv, size=chunk.shape)
+        if highpass:
+            chunk, zi = sig.sosfilt(sos, chunk, axis=-1, zi=zi)
+        start = i * hop
+        stop = min(start + hop, n_times)
+        signals[:, start:stop] = chunk[:, :stop - start]
+    signals.flush()
+    return signals
 
 
 def detect_plateau_onset(freq, psd, f_start, f_range=50, thresh=0.05,
                          step=1, reverse=False,
-                         ff_kwargs=dict(verbose=False, max_n_peaks=1)):
+                         ff_kwargs=dict(verbose=False, max_n_peaks=1),
+                         method='fooof', search='linear', coarse_step=None,
+                         return_n_fits=False):
     """
     Detect the plateau of a power spectrum with 1/f exponent beta < threshold.
 
@@ -122,6 +614,8 @@ def detect_plateau_onset(freq, psd, f_start, f_range=50, thresh=0.05,
     step : int, optional
         Step of loop over fitting range. The default is 1 which might take
         unneccessarily long computation time, but yields maximum precision.
+        See ``search='coarse_to_fine'`` for a faster search with the same
+        precision.
     reverse : bool, optional
         If True, start at high frequencies and detect the end of a pleateau.
         The default is False.
@@ -130,25 +624,140 @@ def detect_plateau_onset(freq, psd, f_start, f_range=50, thresh=0.05,
         The default is dict(verbose=False, max_n_peaks=1).
         max_n_peaks=1: There shouldn't be peaks close to the plateau but
         fitting at least one peak is a good idea for power line noise.
+    method : str, optional
+        'fooof' (default) fits FOOOF at every position. 'slope' computes the
+        exponent of all positions at once as the negative least squares
+        slope in log-log space, using cumulative sums. 'slope_robust' fits
+        each window a second time without the bins that lie more than two
+        standard deviations of the residuals above the first fit, e.g.
+        peaks. Both ignore ``ff_kwargs`` and are orders of magnitude faster.
+    search : str, optional
+        Search of the FOOOF method. 'linear' (default) fits every position
+        one step after another. 'coarse_to_fine' fits the first position
+        and then every ``coarse_step`` until the exponent drops below
+        ``thresh``, and continues one step after another from the last
+        coarse position above it. This finds the same onset as 'linear'
+        with far fewer fits, unless the exponent dips below ``thresh``
+        between two coarse positions above it.
+    coarse_step : int, optional
+        Step of the coarse scan. The default is ``10 * step``.
+    return_n_fits : bool, optional
+        If True, also return the number of FOOOF fits. The default is False.
 
     Returns
     -------
     n_start : float
         Start frequency of plateau.
         If reverse=True, end frequency of plateau.
+    n_fits : int
+        Number of FOOOF fits performed, 0 for the slope methods. Only if
+        ``return_n_fits=True``.
     """
-    exp = 1
+    if method in ('slope', 'slope_robust'):
+        starts = _plateau_starts(freq, f_start, f_range, step, reverse)
+        exponents = _plateau_exponents(freq, psd, starts, f_range, reverse,
+                                       robust=method == 'slope_robust')
+        below = np.flatnonzero(exponents <= thresh)
+        if not below.size:
+            raise ValueError(f"No plateau with exponent <= {thresh} found.")
+        n_start = starts[below[0]] + f_range // 2
+        return (n_start, 0) if return_n_fits else n_start
+    if method != 'fooof':
+        raise ValueError("method must be 'fooof', 'slope' or "
+                         f"'slope_robust', got {method!r}.")
+    if search == 'linear':
+        stride = 1
+    elif search == 'coarse_to_fine':
+        coarse_step = 10 * step if coarse_step is None else coarse_step
+        stride = max(int(round(coarse_step / step)), 1)
+    else:
+        raise ValueError("search must be 'linear' or 'coarse_to_fine', "
+                         f"got {search!r}.")
+    sign = -1 if reverse else 1
     fm = FOOOF(**ff_kwargs)
-    while exp > thresh:
-        if reverse:
-            f_start -= step
-            freq_range = [f_start - f_range, f_start]
-        else:
-            f_start += step
-            freq_range = [f_start, f_start + f_range]
-        fm.fit(freq, psd, freq_range)
-        exp = fm.get_params('aperiodic_params', 'exponent')
-    return f_start + f_range // 2
+    exponents = {}
+
+    def exponent(n_steps):
+        """FOOOF exponent n_steps steps from f_start, fitted once."""
+        if n_steps not in exponents:
+            f_pos = f_start + sign * n_steps * step
+            if reverse:
+                freq_range = [f_pos - f_range, f_pos]
+            else:
+                freq_range = [f_pos, f_pos + f_range]
+            fm.fit(freq, psd, freq_range)
+            exponents[n_steps] = fm.get_params('aperiodic_params',
+                                               'exponent')
+        return exponents[n_steps]
+
+    n_steps = 1
+    if stride > 1:
+        while exponent(n_steps) > thresh:
+            n_steps += stride
+        # Continue after the last coarse position above thresh
+        n_steps = max(n_steps - stride + 1, 1)
+    while exponent(n_steps) > thresh:
+        n_steps += 1
+    n_start = f_start + sign * n_steps * step + f_range // 2
+    return (n_start, len(exponents)) if return_n_fits else n_start
+
+
+def _plateau_starts(freq, f_start, f_range, step, reverse=False):
+    """Window positions of detect_plateau_onset within the freq range."""
+    if reverse:
+        n_steps = int((f_start - f_range - freq[0]) // step)
+        return f_start - step * np.arange(1, n_steps + 1)
+    n_steps = int((freq[-1] - f_range - f_start) // step)
+    return f_start + step * np.arange(1, n_steps + 1)
+
+
+def _plateau_exponents(freq, psd, starts, f_range, reverse=False,
+                       robust=False, n_std=2):
+    """
+    Negative log-log slope of the psd in each window of detect_plateau_onset.
+
+    The windows are [start, start + f_range], or [start - f_range, start] if
+    reverse. The least squares sums of all windows are differences of
+    cumulative sums. If robust, each window is fitted again without the
+    bins more than n_std standard deviations of the residuals above the
+    first fit. Bins with a non-finite log frequency or power, e.g. at 0 Hz,
+    are left out so that they do not spread through the cumulative sums.
+    """
+    lows = starts - f_range if reverse else starts
+    lo = np.searchsorted(freq, lows, 'left')
+    hi = np.searchsorted(freq, lows + f_range, 'right')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x, y = np.log10(freq), np.log10(psd)
+    valid = np.isfinite(x) & np.isfinite(y)
+    x = np.where(valid, x - x[valid].mean(), 0)  # better conditioned sums
+    y = np.where(valid, y, 0)
+    if not robust:
+        cumsums = [np.concatenate([[0], np.cumsum(values)])
+                   for values in (valid.astype(float), x, y, x * x, x * y)]
+        sums = [cumsum[hi] - cumsum[lo] for cumsum in cumsums]
+        return -_line_fit(*sums)[0]
+    bins = lo[:, None] + np.arange((hi - lo).max())
+    inside = (bins < hi[:, None]) & valid[np.minimum(bins, freq.size - 1)]
+    bins = np.minimum(bins, freq.size - 1)
+    x_win, y_win = x[bins], y[bins]
+    slopes, intercepts = _line_fit(*_masked_sums(x_win, y_win, inside))
+    residuals = y_win - (intercepts[:, None] + slopes[:, None] * x_win)
+    std = np.sqrt(np.sum(residuals**2 * inside, axis=-1) / inside.sum(-1))
+    keep = inside & (residuals <= n_std * std[:, None])
+    return -_line_fit(*_masked_sums(x_win, y_win, keep))[0]
+
+
+def _masked_sums(x, y, mask):
+    """Least squares sums of x and y along the last axis where mask."""
+    x, y = x * mask, y * mask
+    return mask.sum(-1), x.sum(-1), y.sum(-1), (x * x).sum(-1), \
+        (x * y).sum(-1)
+
+
+def _line_fit(n, sx, sy, sxx, sxy):
+    """Slopes and intercepts of least squares lines from their sums."""
+    slopes = (n * sxy - sx * sy) / (n * sxx - sx**2)
+    return slopes, (sy - slopes * sx) / n
 
 
 def annotate_range(ax, xmin, xmax, height, ylow=None, yhigh=None,
@@ -270,155 +879,1597 @@ def annotate_range(ax, xmin, xmax, height, ylow=None, yhigh=None,
 def calc_error(signal, lower_fitting_borders, upper_fitting_border,
                toy_slope, sample_rate):
     """Fit IRASA and subtract ground truth to obtain fitting error."""
-    fit_errors = []
-    for i in trange(len(lower_fitting_borders)):
-        freq_range = (lower_fitting_borders[i], upper_fitting_border)
-        _, _, _, params = irasa(data=signal, band=freq_range, sf=sample_rate)
-        exp = -params["Slope"][0]
-        error = np.abs(toy_slope - exp)
-        fit_errors.append(error)
+    bands = [(lower, upper_fitting_border) for lower in lower_fitting_borders]
+    _, _, _, params = irasa_bands(data=signal, bands=bands, sf=sample_rate)
+    exps = -params["Slope"].to_numpy()
+    fit_errors = list(np.abs(toy_slope - exps))
     return fit_errors
 
 
-def calc_psd(x, fs=1.0, nperseg=None, axis=-1, average='mean', **kwargs):
-    """Calculate PSD excluding nan-segments in time series."""
+def calc_psd(x, fs=1.0, nperseg=None, axis=-1, average='mean',
+             median_method='exact', block=64, **kwargs):
+    """
+    Calculate PSD excluding nan-segments in time series.
+
+    Welch's method with the segments processed in blocks. For
+    ``average='mean'`` only NaN-aware sums and counts are accumulated, so
+    memory does not depend on the length of x.
+
+    Parameters
+    ----------
+    x : ndarray or list of ndarray
+        Time series. If a list of arrays is given, e.g. the good spans
+        between bad segments, the Welch segments of all arrays are pooled.
+        Arrays shorter than nperseg are skipped.
+    fs : float
+        Sampling frequency.
+    nperseg : int or None
+        Length of each segment. The default is 256.
+    axis : int
+        Axis along which the PSD is computed.
+    average : str or callable
+        'mean' (default) or 'median' of the segment periodograms. A callable
+        is applied to the periodograms of shape (..., nfreq, nseg).
+    median_method : str
+        'exact' (default) stores the periodograms of all segments for the
+        median. 'p2' estimates the median on the fly with the P-square
+        algorithm and skips segments with NaN in any channel.
+    block : int
+        Number of segments processed at once.
+    **kwargs
+        ``window``, ``noverlap``, ``nfft``, ``detrend`` (also a callable),
+        ``scaling``, and ``return_onesided=True`` as in
+        :py:func:`scipy.signal.welch`. Other keywords raise a ValueError.
+
+    Returns
+    -------
+    f : ndarray
+        Frequencies.
+    psd : ndarray
+        Average of the segment periodograms without NaN.
+    """
+    nperseg = 256 if nperseg is None else int(nperseg)
+    kwargs = _check_welch_kwargs(kwargs)
+    spans = [np.moveaxis(span, axis, -1)
+             for span in (x if isinstance(x, list) else [x])]
+    spans = [span for span in spans if span.shape[-1] >= nperseg]
+    if not spans:
+        raise ValueError(f"No segment of at least nperseg={nperseg} "
+                         "samples.")
+    f = np.fft.rfftfreq(kwargs.get('nfft') or nperseg, 1 / fs)
+    blocks = (pxx for span in spans
+              for pxx in _iter_periodograms(span, fs, nperseg, block=block,
+                                            **kwargs))
+
     if average == 'mean':
-        def average(x):
-            return np.nanmean(x, axis=-1)
-    if average == 'median':
-        def average(x):
-            return (np.nanmedian(x, axis=-1) /
-                    sig.spectral._median_bias(x.shape[-1]))
-    f, t, csd = sig._spectral_py._spectral_helper(x, x,
-                                                  fs=fs, nperseg=nperseg,
-                                                  axis=-1, mode='psd',
-                                                  **kwargs)
-    # calculate the requested average
-    try:
-        csd_mean = average(csd)
-    except(TypeError):
-        f'average must be a function, got {type(average)}'
-    else:
-        return f, csd_mean
+        psd_sum, count = 0, 0
+        for pxx in blocks:
+            psd_sum = psd_sum + np.nansum(pxx, axis=-2)
+            count = count + (~np.isnan(pxx)).sum(axis=-2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return f, psd_sum / count
+    if average == 'median' and median_method == 'p2':
+        median = _P2Median()
+        for pxx in blocks:
+            good = ~np.isnan(pxx).any(axis=-1)
+            good = good.reshape(-1, good.shape[-1]).all(axis=0)
+            for pxx_seg in np.moveaxis(pxx[..., good, :], -2, 0):
+                median.update(pxx_seg)
+        if not median._count:
+            raise ValueError("All segments contain NaN.")
+        return f, median.result() / _median_bias(median._count)
+    if average != 'median' and not callable(average):
+        raise ValueError(f"average must be 'mean', 'median', or a function, "
+                         f"got {average!r}.")
+    if median_method not in ('exact', 'p2'):
+        raise ValueError("median_method must be 'exact' or 'p2', "
+                         f"got {median_method!r}.")
+    csd = np.swapaxes(np.concatenate(list(blocks), axis=-2), -1, -2)
+    if callable(average):
+        return f, average(csd)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN slices
+        psd_median = np.nanmedian(csd, axis=-1)
+    return f, psd_median / _median_bias((~np.isnan(csd)).sum(axis=-1))
 
 
-def irasa(data, sf=None, ch_names=None, band=(1, 30),
-          hset=[1.1, 1.15, 1.2, 1.25, 1.3, 1.35, 1.4, 1.45, 1.5, 1.55, 1.6,
-          1.65, 1.7, 1.75, 1.8, 1.85, 1.9], return_fit=True, win_sec=4,
-          reject_bad_segs=True,
-          kwargs_welch=dict(average='mean', window='hann')):
+_WELCH_KWARGS = ('window', 'noverlap', 'nfft', 'detrend', 'scaling',
+                 'return_onesided')
+
+
+def _check_welch_kwargs(kwargs):
+    """Return the Welch keywords supported by calc_psd or raise."""
+    unsupported = sorted(set(kwargs) - set(_WELCH_KWARGS))
+    if unsupported:
+        raise ValueError(f"Unsupported Welch keyword(s) {unsupported}. "
+                         f"Supported are {list(_WELCH_KWARGS)}.")
+    kwargs = dict(kwargs)
+    if not kwargs.pop('return_onesided', True):
+        raise ValueError("return_onesided=False is not supported, only "
+                         "one-sided PSDs of real data.")
+    return kwargs
+
+
+def _median_bias(n):
     """
-    Function modified from https://github.com/raphaelvallat/yasa/.
+    Bias of the median of n periodogram values relative to their mean.
 
-    Separate the aperiodic (= fractal, or 1/f) and oscillatory component
-    of the power spectra of EEG data using the IRASA method.
+    Same as the bias correction of :py:func:`scipy.signal.welch`, for
+    scalar or array n.
+    """
+    n = np.asarray(n)
+    ii_2 = 2 * np.arange(1., max((int(n.max()) - 1) // 2, 0) + 1)
+    bias = np.r_[0, np.cumsum(1 / (ii_2 + 1) - 1 / ii_2)]
+    return 1 + bias[np.maximum((n - 1) // 2, 0)]
 
-    .. versionadded:: 0.1.7
 
-    Parameters
-    ----------
-    data : :py:class:`numpy.ndarray` or :py:class:`mne.io.BaseRaw`
-        1D or 2D EEG data. Can also be a :py:class:`mne.io.BaseRaw`, in which
-        case ``data``, ``sf``, and ``ch_names`` will be automatically
-        extracted, and ``data`` will also be converted from Volts (MNE default)
-        to micro-Volts (YASA).
-    sf : float
-        The sampling frequency of data AND the hypnogram.
-        Can be omitted if ``data`` is a :py:class:`mne.io.BaseRaw`.
-    ch_names : list
-        List of channel names, e.g. ['Cz', 'F3', 'F4', ...]. If None,
-        channels will be labelled ['CHAN000', 'CHAN001', ...].
-        Can be omitted if ``data`` is a :py:class:`mne.io.BaseRaw`.
-    band : tuple or None
-        Broad band frequency range.
-        Default is 1 to 30 Hz.
-    hset : list or :py:class:`numpy.ndarray`
-        Resampling factors used in IRASA calculation. Default is to use a range
-        of values from 1.1 to 1.9 with an increment of 0.05.
-    return_fit : boolean
-        If True (default), fit an exponential function to the aperiodic PSD
-        and return the fit parameters (intercept, slope) and :math:`R^2` of
-        the fit.
+def _periodograms(segments, fs, window, detrend='constant',
+                  scaling='density', nfft=None):
+    """
+    One-sided periodograms of segments along the last axis.
 
-        The aperiodic signal, :math:`L`, is modeled using an exponential
-        function in semilog-power space (linear frequencies and log PSD) as:
+    Identical to the segment periodograms of :py:func:`scipy.signal.welch`.
+    The segments are zero-padded to nfft samples if given.
+    """
+    nperseg = segments.shape[-1]
+    nfft = nperseg if nfft is None else int(nfft)
+    if nfft < nperseg:
+        raise ValueError('nfft must be greater than or equal to nperseg.')
+    if np.ndim(window) == 1:
+        win = np.asarray(window)
+    else:
+        win = sig.get_window(window, nperseg)
+    if callable(detrend):
+        segments = detrend(segments)
+    elif detrend:
+        segments = sig.detrend(segments, type=detrend, axis=-1)
+    if scaling == 'density':
+        scale = 1.0 / (fs * (win * win).sum())
+    elif scaling == 'spectrum':
+        scale = 1.0 / win.sum()**2
+    else:
+        raise ValueError(f'Unknown scaling: {scaling!r}')
+    pxx = np.abs(rfft(segments * win, n=nfft, axis=-1))**2 * scale
+    if nfft % 2:
+        pxx[..., 1:] *= 2
+    else:
+        pxx[..., 1:-1] *= 2
+    return pxx
 
-        .. math:: L = a + \text{log}(F^b)
 
-        where :math:`a` is the intercept, :math:`b` is the slope, and
-        :math:`F` the vector of input frequencies.
-    win_sec : int or float
-        The length of the sliding window, in seconds, used for the Welch PSD
-        calculation. Ideally, this should be at least two times the inverse of
-        the lower frequency of interest (e.g. for a lower frequency of interest
-        of 0.5 Hz, the window length should be at least 2 * 1 / 0.5 =
-        4 seconds).
-    kwargs_welch : dict
-        Optional keywords arguments that are passed to the
-        :py:func:`scipy.signal.welch` function.
+def _iter_periodograms(x, fs, nperseg, noverlap=None, block=64,
+                       window='hann', **kwargs):
+    """Yield the periodograms of the Welch segments of x in blocks."""
+    step = nperseg - (nperseg // 2 if noverlap is None else noverlap)
+    nseg = max((x.shape[-1] - nperseg) // step + 1, 0)
+    if not nseg:
+        return
+    segments = np.lib.stride_tricks.sliding_window_view(
+        x, nperseg, axis=-1)[..., :nseg * step:step, :]
+    for i in range(0, nseg, block):
+        yield _periodograms(segments[..., i:i + block, :], fs, window,
+                            **kwargs)
+
+
+def _segment_periodograms(x, fs, nperseg, noverlap=None, freq_mask=None,
+                          block=64, **kwargs):
+    """
+    Periodograms of all Welch segments of x.
+
+    Segments are processed in blocks to limit temporary memory. If given,
+    only the frequencies in freq_mask are returned.
 
     Returns
     -------
-    freqs : :py:class:`numpy.ndarray`
-        Frequency vector.
-    psd_aperiodic : :py:class:`numpy.ndarray`
-        The fractal (= aperiodic) component of the PSD.
-    psd_oscillatory : :py:class:`numpy.ndarray`
-        The oscillatory (= periodic) component of the PSD.
-    fit_params : :py:class:`pandas.DataFrame` (optional)
-        Dataframe of fit parameters. Only if ``return_fit=True``.
+    pxx : ndarray
+        Periodograms of shape (nchan, nseg, nfreq).
+    """
+    step = nperseg - (nperseg // 2 if noverlap is None else noverlap)
+    nseg = max((x.shape[-1] - nperseg) // step + 1, 0)
+    if freq_mask is None:
+        freq_mask = np.ones((kwargs.get('nfft') or nperseg) // 2 + 1, bool)
+    pxx = np.empty((*x.shape[:-1], nseg, freq_mask.sum()))
+    blocks = _iter_periodograms(x, fs, nperseg, noverlap, block, **kwargs)
+    for i, block_pxx in zip(range(0, nseg, block), blocks):
+        pxx[..., i:i + block, :] = block_pxx[..., freq_mask]
+    return pxx
 
-    Notes
-    -----
-    The Irregular-Resampling Auto-Spectral Analysis (IRASA) method is
-    described in Wen & Liu (2016). In a nutshell, the goal is to separate the
-    fractal and oscillatory components in the power spectrum of EEG signals.
 
-    The steps are:
+class _WelchAccumulator:
+    """
+    Welch PSD of a signal that is passed in consecutive blocks.
 
-    1. Compute the original power spectral density (PSD) using Welch's method.
-    2. Resample the EEG data by multiple non-integer factors and their
-       reciprocals (:math:`h` and :math:`1/h`).
-    3. For every pair of resampled signals, calculate the PSD and take the
-       geometric mean of both. In the resulting PSD, the power associated with
-       the oscillatory component is redistributed away from its original
-       (fundamental and harmonic) frequencies by a frequency offset that varies
-       with the resampling factor, whereas the power solely attributed to the
-       fractal component remains the same power-law statistical distribution
-       independent of the resampling factor.
-    4. It follows that taking the median of the PSD of the variously
-       resampled signals can extract the power spectrum of the fractal
-       component, and the difference between the original power spectrum and
-       the extracted fractal spectrum offers an approximate estimate of the
-       power spectrum of the oscillatory component.
+    Only the samples of an incomplete segment are kept between blocks, so
+    memory does not depend on the signal length. The result equals
+    :py:func:`scipy.signal.welch` with ``average='mean'`` of the concatenated
+    blocks.
+    """
 
-    Note that an estimate of the original PSD can be calculated by simply
-    adding ``psd = psd_aperiodic + psd_oscillatory``.
+    def __init__(self, fs, nperseg, window='hann', noverlap=None,
+                 detrend='constant', scaling='density', nfft=None):
+        self.fs = fs
+        self.nperseg = nperseg
+        self.noverlap = nperseg // 2 if noverlap is None else noverlap
+        self.nfft = nperseg if nfft is None else nfft
+        self.kwargs = dict(window=window, detrend=detrend, scaling=scaling,
+                           nfft=nfft)
+        self._buffer = None
+        self._sum = 0
+        self._count = 0
 
-    For an example of how to use this function, please refer to
-    https://github.com/raphaelvallat/yasa/blob/master/notebooks/09_IRASA.ipynb
+    def update(self, block):
+        """Add the next block of samples of shape (nchan, n_samples)."""
+        if self._buffer is not None:
+            block = np.concatenate([self._buffer, block], axis=-1)
+        pxx = _segment_periodograms(block, self.fs, self.nperseg,
+                                    self.noverlap, **self.kwargs)
+        nseg = pxx.shape[-2]
+        self._sum = self._sum + pxx.sum(axis=-2)
+        self._count += nseg
+        self._buffer = block[..., nseg * (self.nperseg - self.noverlap):]
 
-    References
-    ----------
-    [1] Wen, H., & Liu, Z. (2016). Separating Fractal and Oscillatory
-    Components in the Power Spectrum of Neurophysiological Signal.
-    Brain Topography, 29(1), 13–26.
-    https://doi.org/10.1007/s10548-015-0448-0
+    def result(self):
+        """Return frequencies and the mean PSD of all complete segments."""
+        freqs = np.fft.rfftfreq(self.nfft, 1 / self.fs)
+        return freqs, self._sum / self._count
 
-    [2] https://github.com/fieldtrip/fieldtrip/blob/master/specest/
 
-    [3] https://github.com/fooof-tools/fooof
+class IrasaCache:
+    """
+    Cache of IRASA decompositions keyed by a hash of data and parameters.
 
-    [4] https://www.biorxiv.org/content/10.1101/299859v1
+    Decompositions are kept in an in-memory LRU cache and optionally in
+    .npz files in ``cache_dir``. Pass the same instance to repeated
+    :py:func:`irasa` or :py:func:`irasa_bands` calls to avoid recomputing
+    the resampled PSDs, e.g. when only ``band`` or ``return_fit`` change.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of decompositions kept in memory. The default is 32.
+    cache_dir : str, optional
+        Directory of the on-disk cache. If None, only the in-memory cache
+        is used. The default is None.
+    max_disk_bytes : int, optional
+        Size limit of the on-disk cache. The least recently used files are
+        deleted when the limit is exceeded. The default is 1 GB.
     """
-    # Check if input data is a MNE Raw object
-    if isinstance(data, mne.io.BaseRaw):
-        sf = data.info['sfreq']  # Extract sampling frequency
-        ch_names = data.ch_names  # Extract channel names
-        # Convert from V to uV
-        data = data.get_data(reject_by_annotation="nan") * 1e6
-    else:
-        # Safety checks
+
+    def __init__(self, maxsize=32, cache_dir=None, max_disk_bytes=1e9):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(data, *params):
+        """Hash the data buffer together with the parameters."""
+        hasher = hashlib.blake2b(digest_size=20)
+        _update_hash(hasher, (data, params))
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        """Return cached arrays as copies or None if key is not cached."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return tuple(arr.copy() for arr in self._memory[key])
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as npz:
+                arrays = tuple(npz[name] for name in sorted(npz.files))
+            os.utime(self._path(key))  # mark as recently used
+            self._put_memory(key, arrays)
+            return tuple(arr.copy() for arr in arrays)
+        return None
+
+    def put(self, key, arrays):
+        """Store a tuple of arrays."""
+        arrays = tuple(np.array(arr) for arr in arrays)
+        self._put_memory(key, arrays)
+        if self.cache_dir is not None:
+            np.savez(self._path(key), **{f"arr_{i:02d}": arr
+                                         for i, arr in enumerate(arrays)})
+            self._evict_disk()
+
+    def clear(self):
+        """Remove all entries from memory and disk."""
+        self._memory.clear()
+        if self.cache_dir is not None:
+            for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+                os.remove(path)
+
+    def _put_memory(self, key, arrays):
+        self._memory[key] = arrays
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        paths = sorted(glob.glob(os.path.join(self.cache_dir, "*.npz")),
+                       key=os.path.getmtime)
+        sizes = [os.path.getsize(path) for path in paths]
+        while paths and sum(sizes) > self.max_disk_bytes:
+            os.remove(paths.pop(0))
+            sizes.pop(0)
+
+
+def _update_hash(hasher, obj):
+    """
+    Feed obj to hasher, arrays by their buffer.
+
+    repr abbreviates long arrays, so arrays, also inside tuples and lists,
+    are hashed by dtype, shape, and bytes.
+    """
+    if isinstance(obj, np.ndarray):
+        obj = np.ascontiguousarray(obj)
+        hasher.update(repr(("ndarray", obj.dtype.str, obj.shape)).encode())
+        hasher.update(obj.data)
+    elif isinstance(obj, (tuple, list)):
+        hasher.update(f"{type(obj).__name__}({len(obj)})".encode())
+        for item in obj:
+            _update_hash(hasher, item)
+    else:
+        hasher.update(repr(obj).encode())
+
+
+def _map(func, iterable, n_jobs=1, executor=None):
+    """
+    Map func over iterable, serially or on a pool, preserving the order.
+
+    Tasks are submitted lazily so that at most twice as many results as
+    workers are held in memory at once.
+
+    Parameters
+    ----------
+    func : callable
+        Function applied to each element. Must be picklable if a process
+        pool is used.
+    iterable : iterable
+        Arguments.
+    n_jobs : int or None, optional
+        Number of threads. 1 or None runs serially, negative values count
+        backwards from the number of CPUs (-1 uses all CPUs).
+        The default is 1.
+    executor : concurrent.futures.Executor, optional
+        Pool to use instead of creating a thread pool. If given, n_jobs is
+        ignored. The default is None.
+
+    Yields
+    ------
+    result
+        Results in the order of iterable.
+    """
+    n_jobs = _n_workers(n_jobs, executor)
+    if n_jobs == 1 and executor is None:
+        yield from map(func, iterable)
+        return
+    pool = ThreadPoolExecutor(n_jobs) if executor is None else executor
+    try:
+        futures = deque()
+        for arg in iterable:
+            futures.append(pool.submit(func, arg))
+            if len(futures) >= 2 * n_jobs:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+
+def _n_workers(n_jobs=1, executor=None):
+    """Return the number of workers used by _map."""
+    if executor is not None:
+        return os.cpu_count()
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+class _ExactMedian:
+    """Median over consecutively added arrays, stored in a buffer."""
+
+    def __init__(self, n, dtype=np.float64):
+        self.n = n
+        self.dtype = dtype
+        self._buffer = None
+        self._count = 0
+
+    def update(self, x):
+        if self._buffer is None:
+            self._buffer = np.zeros((self.n, *x.shape), self.dtype)
+        self._buffer[self._count] = x
+        self._count += 1
+
+    def result(self):
+        return np.median(self._buffer[:self._count], axis=0)
+
+
+class _P2Median:
+    """
+    Streaming approximate median over consecutively added arrays.
+
+    Element-wise P-square algorithm of Jain & Chlamtac (1985). Only five
+    marker heights and positions are stored per element, independent of
+    the number of arrays. The estimate is exact for up to five arrays and
+    approximate otherwise.
+    """
+
+    _increments = np.array([0, .25, .5, .75, 1])
+
+    def __init__(self, n=None, dtype=np.float64):
+        self.dtype = dtype
+        self._heights = None  # marker heights q
+        self._positions = None  # marker positions n (1-based)
+        self._count = 0
+
+    def update(self, x):
+        x = np.asarray(x, self.dtype)
+        if self._heights is None:
+            self._heights = np.zeros((5, *x.shape), self.dtype)
+        if self._count < 5:
+            self._heights[self._count] = x
+            self._count += 1
+            if self._count == 5:
+                self._heights.sort(axis=0)
+                self._positions = np.broadcast_to(
+                    np.arange(1, 6, dtype=np.int32).reshape(
+                        (5,) + (1,) * x.ndim), self._heights.shape).copy()
+            return
+        q, pos = self._heights, self._positions
+        self._count += 1
+
+        # Find the cell of x and update the extreme markers
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        pos[1:] += x < q[1:]  # all markers above x move up
+        pos[4] = self._count
+        desired = 1 + (self._count - 1) * self._increments
+
+        # Adjust the three middle markers if necessary
+        for i in range(1, 4):
+            delta = desired[i] - pos[i]
+            up = (delta >= 1) & (pos[i + 1] - pos[i] > 1)
+            down = (delta <= -1) & (pos[i - 1] - pos[i] < -1)
+            d = up.astype(np.int32) - down
+            if not d.any():
+                continue
+            # Piecewise-parabolic prediction
+            with np.errstate(invalid='ignore', divide='ignore'):
+                q_new = q[i] + d / (pos[i + 1] - pos[i - 1]) * (
+                    (pos[i] - pos[i - 1] + d) * (q[i + 1] - q[i])
+                    / (pos[i + 1] - pos[i])
+                    + (pos[i + 1] - pos[i] - d) * (q[i] - q[i - 1])
+                    / (pos[i] - pos[i - 1]))
+                # Linear prediction if the parabolic one is not monotonic
+                q_lin = np.where(d > 0,
+                                 q[i] + (q[i + 1] - q[i])
+                                 / (pos[i + 1] - pos[i]),
+                                 q[i] - (q[i - 1] - q[i])
+                                 / (pos[i - 1] - pos[i]))
+            parabolic = (q[i - 1] < q_new) & (q_new < q[i + 1])
+            q[i] = np.where(d == 0, q[i], np.where(parabolic, q_new, q_lin))
+            pos[i] += d
+
+    def result(self):
+        if self._count < 5:
+            return np.median(self._heights[:self._count], axis=0)
+        return self._heights[2].copy()
+
+
+_MEDIANS = {'exact': _ExactMedian, 'p2': _P2Median}
+
+
+def irasa_factors(hset, max_denominator=None):
+    """
+    Return the resampling factors actually used by IRASA.
+
+    Each factor h is converted to a ratio of integers up/down for polyphase
+    resampling by h and 1/h. Large up and down values lead to long
+    resampling filters. Limiting the denominator approximates h by a
+    simpler ratio and speeds up the resampling.
+
+    Parameters
+    ----------
+    hset : list or ndarray
+        Resampling factors.
+    max_denominator : int, optional
+        Largest allowed denominator of the ratios. If None, h is represented
+        exactly (after rounding to 4 decimals). The default is None.
+
+    Returns
+    -------
+    hset_used : ndarray
+        Resampling factors up/down. The signals are resampled by exactly
+        these factors and their reciprocals.
+    """
+    ratios = _resampling_ratios(hset, max_denominator)
+    return np.array([rat.numerator / rat.denominator for rat in ratios])
+
+
+class ResamplePlan:
+    """
+    Precomputed polyphase resampling by a factor h and by 1/h.
+
+    The ratio up/down and the anti-aliasing FIR filter of
+    :py:func:`scipy.signal.resample_poly` are computed once. Resampling by h
+    and 1/h uses the same filter, which only depends on max(up, down), so a
+    plan can be reused for any sampling frequency. The output is identical
+    to :py:func:`scipy.signal.resample_poly`.
+
+    Use :py:func:`resample_plans` to get cached plans. Plans can be passed
+    to :py:func:`irasa` in ``hset``.
+
+    Parameters
+    ----------
+    h : float or :py:class:`fractions.Fraction`
+        Resampling factor. Floats are rounded to 4 decimals.
+    max_denominator : int, optional
+        Largest allowed denominator of the ratio. See
+        :py:func:`irasa_factors`.
+    """
+
+    def __init__(self, h, max_denominator=None):
+        if isinstance(h, fractions.Fraction):
+            ratio = h
+        else:
+            ratio = fractions.Fraction(str(np.round(h, 4)))
+        if max_denominator is not None:
+            ratio = ratio.limit_denominator(max_denominator)
+        self.ratio = ratio
+        self.up, self.down = ratio.numerator, ratio.denominator
+        self.h = self.up / self.down
+        # Same filter design as resample_poly
+        max_rate = max(self.up, self.down)
+        self.taps = sig.firwin(2 * 10 * max_rate + 1, 1 / max_rate,
+                               window=('kaiser', 5.0))
+
+    def __repr__(self):
+        return f"ResamplePlan({self.up}/{self.down})"
+
+    def resample(self, data, inverse=False):
+        """
+        Resample data along the last axis by h, or by 1/h if inverse.
+
+        data can also be a list of arrays, which are resampled separately.
+        """
+        up, down = (self.down, self.up) if inverse else (self.up, self.down)
+        if isinstance(data, list):
+            return [self.resample(span, inverse) for span in data]
+        return sig.resample_poly(data, up, down, axis=-1, window=self.taps)
+
+
+def _resample_plan(ratio, plans=None):
+    """Return the ResamplePlan of a Fraction from plans, or the cached one."""
+    if plans and ratio in plans:
+        return plans[ratio]
+    return _cached_resample_plan(ratio)
+
+
+@lru_cache(maxsize=256)
+def _cached_resample_plan(ratio):
+    return ResamplePlan(ratio)
+
+
+def resample_plans(hset, max_denominator=None):
+    """
+    Return the cached resampling plans of hset.
+
+    :py:class:`ResamplePlan` objects in hset are returned as they are.
+
+    The plans are kept in an LRU cache across calls, so that repeated
+    :py:func:`irasa` calls with the same factors do not design the
+    resampling filters again.
+
+    Parameters
+    ----------
+    hset : list or ndarray
+        Resampling factors.
+    max_denominator : int, optional
+        See :py:func:`irasa_factors`.
+
+    Returns
+    -------
+    plans : list of :py:class:`ResamplePlan`
+        Plans in the order of hset.
+    """
+    plans = _hset_plans(hset)
+    return [_resample_plan(rat, plans)
+            for rat in _resampling_ratios(hset, max_denominator)]
+
+
+def _resampling_ratios(hset, max_denominator=None):
+    """
+    Convert hset to fractions, optionally with bounded denominators.
+
+    hset can mix factors and ResamplePlan objects. The ratio of a plan is
+    kept as is, ignoring max_denominator. See _hset_plans for the plans.
+    """
+    if any(isinstance(h, ResamplePlan) for h in hset):
+        assert len(hset) > 1, '2 or more resampling fators are required.'
+    else:
+        hset = _check_hset(hset)
+    ratios = []
+    for h in hset:
+        if isinstance(h, ResamplePlan):
+            ratios.append(h.ratio)
+            continue
+        # Get the upsampling/downsampling (h, 1/h) factors as integer
+        rat = fractions.Fraction(str(np.round(h, 4)))
+        if max_denominator is not None:
+            rat = rat.limit_denominator(max_denominator)
+        ratios.append(rat)
+    if max_denominator is not None and len(set(ratios)) < len(ratios):
+        warnings.warn(f"max_denominator={max_denominator} maps several "
+                      "resampling factors to the same ratio.")
+    return ratios
+
+
+def _hset_plans(hset):
+    """Return the ResamplePlan objects of hset by their ratio."""
+    return {h.ratio: h for h in hset if isinstance(h, ResamplePlan)}
+
+
+class _PolyResampler:
+    """
+    Polyphase resampling of data with the plan of each factor.
+
+    The plans passed in hset are used for their ratios, cached plans for the
+    other factors.
+    """
+
+    def __init__(self, data, plans=None):
+        self.data = data
+        self.plans = plans
+
+    def resample(self, rat, inverse=False):
+        return _resample_plan(rat, self.plans).resample(self.data, inverse)
+
+
+class _FFTResampler:
+    """
+    Fourier resampling of data as :py:func:`scipy.signal.resample`.
+
+    The forward FFT of the data is computed once and shared by all factors,
+    so each factor only costs the inverse FFTs of the resampled signals.
+    The resampled signals have the same length as with
+    :py:func:`scipy.signal.resample_poly`.
+    """
+
+    def __init__(self, data):
+        self.is_list = isinstance(data, list)
+        self.spectra = [(span.shape[-1], rfft(span, axis=-1))
+                        for span in (data if self.is_list else [data])]
+
+    def resample(self, rat, inverse=False):
+        h = 1 / rat if inverse else rat
+        resampled = [_fft_resample(spectrum, npts, math.ceil(npts * h))
+                     for npts, spectrum in self.spectra]
+        return resampled if self.is_list else resampled[0]
+
+
+def _fft_resample(spectrum, npts, num):
+    """Resample a signal of npts samples to num samples from its rfft."""
+    n_keep = min(num, npts)
+    resampled = np.zeros(spectrum.shape[:-1] + (num // 2 + 1,),
+                         spectrum.dtype)
+    resampled[..., :n_keep // 2 + 1] = spectrum[..., :n_keep // 2 + 1]
+    # Split or join the Nyquist component as scipy.signal.resample
+    if n_keep % 2 == 0 and num != npts:
+        resampled[..., n_keep // 2] *= 2 if num < npts else 0.5
+    return sp.fft.irfft(resampled, num, axis=-1) * (num / npts)
+
+
+_RESAMPLERS = {'poly': _PolyResampler, 'fft': _FFTResampler}
+
+
+@lru_cache(maxsize=1)
+def _resampler_costs(npts=2**15):
+    """
+    Calibrate the cost model of the resampling backends.
+
+    Returns the seconds per unit of work of polyphase resampling (one unit
+    per sample and filter tap, see _resampler_cost) and of inverse FFTs of
+    fast and of prime lengths (one unit per m * log2(m)).
+    Measured once per process on white noise of about npts samples.
+    """
+    rng = np.random.default_rng(0)
+    plan = _resample_plan(fractions.Fraction(3, 2))
+    data = rng.standard_normal(npts)
+    spectrum = rfft(data)
+    fast = sp.fft.next_fast_len(npts * 3 // 2, real=True)
+    # Worst case: a prime length
+    slow = fast + 1
+    while any(slow % p == 0 for p in range(2, math.isqrt(slow) + 1)):
+        slow += 1
+
+    def best_time(func, repeat=3):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    t_poly = best_time(lambda: plan.resample(data))
+    t_fast = best_time(lambda: _fft_resample(spectrum, npts, fast))
+    t_slow = best_time(lambda: _fft_resample(spectrum, npts, slow))
+    # Resampling by 3/2 only, i.e. 20 * npts * 3 / 2 units
+    return dict(poly=t_poly / (30 * npts),
+                fast=t_fast / (fast * np.log2(fast)),
+                slow=t_slow / (slow * np.log2(slow)))
+
+
+def _resampler_cost(backend, rat, npts, costs):
+    """
+    Estimated cost of resampling npts samples by rat and 1/rat.
+
+    The polyphase filter has about 20 * up taps, of which 20 * up / down per
+    output sample are applied when upsampling by rat = up / down, and
+    20 * up / down (for npts / rat output samples) when downsampling, which
+    gives about 20 * npts * (rat + 1) units. The FFT backend costs two
+    inverse FFTs, which are much slower for lengths with large prime
+    factors. costs are the seconds per unit from _resampler_costs.
+    """
+    if backend == 'poly':
+        return 20 * npts * (float(rat) + 1) * costs['poly']
+    cost = 0
+    for num in (math.ceil(npts * rat), math.ceil(npts / rat)):
+        fast = sp.fft.next_fast_len(num, real=True) == num
+        cost += num * np.log2(num) * costs['fast' if fast else 'slow']
+    return cost
+
+
+def _choose_resamplers(ratios, npts):
+    """
+    Pick the cheaper backend for each ratio according to the cost model.
+
+    npts is the list of lengths of the good spans. The FFT backend is only
+    used if the factors it saves pay for the shared forward transform.
+    """
+    costs = _resampler_costs()
+    choices, saved = {}, 0
+    for rat in ratios:
+        cost_poly = sum(_resampler_cost('poly', rat, n, costs) for n in npts)
+        cost_fft = sum(_resampler_cost('fft', rat, n, costs) for n in npts)
+        choices[rat] = 'fft' if cost_fft < cost_poly else 'poly'
+        saved += max(cost_poly - cost_fft, 0)
+    forward = sum(n * np.log2(n) * costs['fast'] for n in npts)
+    if saved <= forward:
+        return {rat: 'poly' for rat in ratios}
+    return choices
+
+
+class _AutoResampler:
+    """Resample each factor with the backend chosen by the cost model."""
+
+    def __init__(self, data, ratios, plans=None):
+        spans = data if isinstance(data, list) else [data]
+        self.choices = _choose_resamplers(ratios,
+                                          [span.shape[-1] for span in spans])
+        self.resamplers = {backend: _make_resampler(backend, data, ratios,
+                                                    plans)
+                           for backend in set(self.choices.values())}
+
+    def resample(self, rat, inverse=False):
+        return self.resamplers[self.choices[rat]].resample(rat, inverse)
+
+
+def _make_resampler(resampler, data, ratios, plans=None):
+    """Return the resampling backend named resampler for data."""
+    if resampler == 'auto':
+        return _AutoResampler(data, ratios, plans)
+    if resampler == 'poly':
+        return _PolyResampler(data, plans)
+    return _RESAMPLERS[resampler](data)
+
+
+def _irasa_factor_psd(rat, resampler, sf, win, kwargs_welch):
+    """Geometric mean of the PSDs of data resampled by rat and 1/rat."""
+    h = float(rat)
+    # Good spans between bad segments are resampled separately and their
+    # segments pooled.
+    data_up = resampler.resample(rat)
+    data_down = resampler.resample(rat, inverse=True)
+    # Calculate the PSD using same params as original
+    # ==========================================================================
+    # MG: CHANGED TO ALLOW NAN SEGMENTS
+    freqs_up, psd_up = calc_psd(data_up, h * sf, nperseg=win, **kwargs_welch)
+    freqs_dw, psd_dw = calc_psd(data_down, sf / h, nperseg=win,
+                                **kwargs_welch)
+    # ==========================================================================
+    # Geometric mean of h and 1/h
+    return np.sqrt(psd_up * psd_dw)
+
+
+def _irasa_segment_factor_psd(rat, data, sf, win, kwargs_welch, h_max,
+                              block=64, plans=None):
+    """
+    Geometric mean of the PSDs of Welch segments resampled by rat and 1/rat.
+
+    Segments long enough for the largest factor h_max are cut once. For each
+    direction, the central part needed for win output samples plus the
+    filter transients is resampled in blocks of segments, and the central
+    win samples are transformed with a batched FFT.
+    """
+    plan = _resample_plan(rat, plans)
+    kwargs = dict(kwargs_welch)
+    if kwargs.pop('average', 'mean') != 'mean':
+        raise ValueError("engine='segment' only supports average='mean'.")
+    noverlap = kwargs.pop('noverlap', None)
+    kwargs = _check_welch_kwargs(kwargs)
+    kwargs.setdefault('window', 'hann')
+    step = win - (win // 2 if noverlap is None else noverlap)
+    # Filter transients at each edge of the resampled segments
+    edge = int(np.ceil(10 * h_max)) + 1
+    seg_len = int(np.ceil(h_max * (win + 2 * edge)))
+    len_out = win + 2 * edge
+    directions = [(False, plan.h * sf, int(np.ceil(len_out / plan.h))),
+                  (True, sf / plan.h, int(np.ceil(len_out * plan.h)))]
+    psd_sums, counts = [0, 0], [0, 0]
+    for span in (data if isinstance(data, list) else [data]):
+        nseg = max((span.shape[-1] - seg_len) // step + 1, 0)
+        if not nseg:
+            continue
+        segments = np.lib.stride_tricks.sliding_window_view(
+            span, seg_len, axis=-1)[..., :nseg * step:step, :]
+        for i in range(0, nseg, block):
+            for j, (inverse, fs, len_in) in enumerate(directions):
+                offset = (seg_len - len_in) // 2
+                resampled = plan.resample(
+                    segments[..., i:i + block, offset:offset + len_in],
+                    inverse)
+                start = (resampled.shape[-1] - win) // 2
+                pxx = _periodograms(resampled[..., start:start + win], fs,
+                                    **kwargs)
+                psd_sums[j] = psd_sums[j] + np.nansum(pxx, axis=-2)
+                counts[j] = counts[j] + (~np.isnan(pxx)).sum(axis=-2)
+    if np.ndim(counts[0]) == 0:
+        raise ValueError(f"engine='segment' requires at least {seg_len} "
+                         "samples of data without NaN.")
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt((psd_sums[0] / counts[0]) *
+                       (psd_sums[1] / counts[1]))
+
+
+def irasa(data, sf=None, ch_names=None, band=(1, 30),
+          hset=[1.1, 1.15, 1.2, 1.25, 1.3, 1.35, 1.4, 1.45, 1.5, 1.55, 1.6,
+          1.65, 1.7, 1.75, 1.8, 1.85, 1.9], return_fit=True, win_sec=4,
+          reject_bad_segs=True,
+          kwargs_welch=dict(average='mean', window='hann'),
+          n_jobs=1, executor=None, cache=None, fit_method='curve_fit',
+          decimate=False, max_denominator=None, median_method='exact',
+          psd_dtype=np.float64, chunk_channels=None, max_memory=None,
+          engine='signal', resampler='poly'):
+    """
+    Function modified from https://github.com/raphaelvallat/yasa/.
+
+    Separate the aperiodic (= fractal, or 1/f) and oscillatory component
+    of the power spectra of EEG data using the IRASA method.
+
+    .. versionadded:: 0.1.7
+
+    Parameters
+    ----------
+    data : :py:class:`numpy.ndarray` or :py:class:`mne.io.BaseRaw`
+        1D or 2D EEG data. Can also be a :py:class:`mne.io.BaseRaw`, in which
+        case ``data``, ``sf``, and ``ch_names`` will be automatically
+        extracted, and ``data`` will also be converted from Volts (MNE default)
+        to micro-Volts (YASA).
+    sf : float
+        The sampling frequency of data AND the hypnogram.
+        Can be omitted if ``data`` is a :py:class:`mne.io.BaseRaw`.
+    ch_names : list
+        List of channel names, e.g. ['Cz', 'F3', 'F4', ...]. If None,
+        channels will be labelled ['CHAN000', 'CHAN001', ...].
+        Can be omitted if ``data`` is a :py:class:`mne.io.BaseRaw`.
+    band : tuple or None
+        Broad band frequency range.
+        Default is 1 to 30 Hz.
+    hset : list or :py:class:`numpy.ndarray`
+        Resampling factors used in IRASA calculation. Default is to use a range
+        of values from 1.1 to 1.9 with an increment of 0.05. Can also
+        contain :py:class:`ResamplePlan` objects, whose filters are used as
+        is. The resampling filters of the other factors are cached across
+        calls, see :py:func:`resample_plans`.
+    return_fit : boolean
+        If True (default), fit an exponential function to the aperiodic PSD
+        and return the fit parameters (intercept, slope) and :math:`R^2` of
+        the fit.
+
+        The aperiodic signal, :math:`L`, is modeled using an exponential
+        function in semilog-power space (linear frequencies and log PSD) as:
+
+        .. math:: L = a + \text{log}(F^b)
+
+        where :math:`a` is the intercept, :math:`b` is the slope, and
+        :math:`F` the vector of input frequencies.
+    fit_method : str
+        'curve_fit' (default) fits each channel with
+        :py:func:`scipy.optimize.curve_fit`. 'lstsq' solves the linear least
+        squares problem for all channels at once, which is much faster for
+        many channels and yields the same parameters. Both restrict the slope
+        to [-10, 2].
+    decimate : boolean
+        If True, anti-alias filter and decimate the data by the largest
+        integer factor that keeps ``band[1] * max(hset)`` within 80% of the
+        new Nyquist frequency before resampling. This speeds up high sample
+        rate data with a low frequency band considerably. A warning is
+        issued and the data is not decimated if this is not possible.
+        The default is False.
+    max_denominator : int or None
+        If given, approximate each resampling factor by a ratio of integers
+        with a denominator of at most ``max_denominator``. This shortens the
+        resampling filters for factors such as 1.11 = 111 / 100. Use
+        :py:func:`irasa_factors` to obtain the factors actually used.
+        The default is None (exact factors).
+    median_method : str
+        'exact' (default) stores the PSDs of all resampling factors and takes
+        their median. 'p2' estimates the median on the fly with the P-square
+        algorithm, which stores only five values per frequency and channel
+        independent of ``len(hset)``. The estimate is approximate
+        (typically within 1-2% of the exact median) if more than five
+        resampling factors are used.
+    psd_dtype : dtype
+        Data type used to store the resampled PSDs for the median, e.g.
+        ``np.float32`` to halve the memory. The default is ``np.float64``.
+    chunk_channels : int or None
+        If given, process blocks of ``chunk_channels`` channels one after
+        another to limit the memory of the resampled signals. The output is
+        unchanged. The default is None (all channels at once).
+    max_memory : int or None
+        Approximate memory budget in bytes. Overrides ``chunk_channels``
+        with the largest block size whose estimated peak memory, about
+        ``(3 + 4 * max(hset)) * 8 * n_samples`` bytes per channel and
+        parallel job, fits into the budget. The default is None.
+    engine : str
+        'signal' (default) resamples the whole signal for each factor and
+        computes the Welch PSD of the resampled signals. 'segment' cuts the
+        data into Welch segments once and resamples each segment by h and
+        1/h as in Wen & Liu (2016). The segments are long enough for
+        ``max(hset)``, and the central ``win_sec`` of each resampled segment
+        is used, so that all factors average the same number of segments.
+        Only ``average='mean'`` is supported.
+    resampler : str
+        Resampling backend of ``engine='signal'``. 'poly' (default) uses
+        polyphase filtering as :py:func:`scipy.signal.resample_poly`. 'fft'
+        resamples in the Fourier domain as :py:func:`scipy.signal.resample`
+        and shares the forward FFT of the data across all factors, so that
+        each factor only costs two inverse FFTs. It assumes the signal is
+        periodic, which slightly affects the first and last Welch segments.
+        'auto' picks the cheaper backend for each factor from a cost model
+        of the number of samples and the FFT lengths, calibrated once per
+        process with a short timing run.
+    win_sec : int or float
+        The length of the sliding window, in seconds, used for the Welch PSD
+        calculation. Ideally, this should be at least two times the inverse of
+        the lower frequency of interest (e.g. for a lower frequency of interest
+        of 0.5 Hz, the window length should be at least 2 * 1 / 0.5 =
+        4 seconds).
+    reject_bad_segs : boolean
+        If True (default), segments annotated as bad in MNE Raw data and NaN
+        samples are excluded. The contiguous good spans are resampled
+        separately and the Welch segments of all spans are pooled, so that
+        good data next to a bad segment is kept. If False, all data of MNE
+        Raw objects is used.
+    kwargs_welch : dict
+        Optional keywords arguments of the Welch PSD, as in
+        :py:func:`scipy.signal.welch`: ``average``, ``window``,
+        ``noverlap``, ``nfft``, ``detrend`` (also a callable), ``scaling``,
+        and ``return_onesided=True``. Other keywords raise a ValueError.
+    n_jobs : int or None
+        Number of threads used to process the resampling factors in
+        parallel. 1 (default) runs serially, -1 uses all CPUs. The output is
+        identical to the serial computation.
+    executor : :py:class:`concurrent.futures.Executor` or None
+        Pool used to process the resampling factors instead of a thread pool,
+        e.g. a :py:class:`concurrent.futures.ProcessPoolExecutor`. If given,
+        ``n_jobs`` is ignored.
+    cache : :py:class:`IrasaCache` or None
+        Cache of decompositions. If the same data was already decomposed
+        with the same ``sf``, ``hset``, ``win_sec``, and ``kwargs_welch``,
+        the cached aperiodic PSD is used. The default is None.
+
+    Returns
+    -------
+    freqs : :py:class:`numpy.ndarray`
+        Frequency vector.
+    psd_aperiodic : :py:class:`numpy.ndarray`
+        The fractal (= aperiodic) component of the PSD.
+    psd_oscillatory : :py:class:`numpy.ndarray`
+        The oscillatory (= periodic) component of the PSD.
+    fit_params : :py:class:`pandas.DataFrame` (optional)
+        Dataframe of fit parameters. Only if ``return_fit=True``.
+
+    Notes
+    -----
+    The Irregular-Resampling Auto-Spectral Analysis (IRASA) method is
+    described in Wen & Liu (2016). In a nutshell, the goal is to separate the
+    fractal and oscillatory components in the power spectrum of EEG signals.
+
+    The steps are:
+
+    1. Compute the original power spectral density (PSD) using Welch's method.
+    2. Resample the EEG data by multiple non-integer factors and their
+       reciprocals (:math:`h` and :math:`1/h`).
+    3. For every pair of resampled signals, calculate the PSD and take the
+       geometric mean of both. In the resulting PSD, the power associated with
+       the oscillatory component is redistributed away from its original
+       (fundamental and harmonic) frequencies by a frequency offset that varies
+       with the resampling factor, whereas the power solely attributed to the
+       fractal component remains the same power-law statistical distribution
+       independent of the resampling factor.
+    4. It follows that taking the median of the PSD of the variously
+       resampled signals can extract the power spectrum of the fractal
+       component, and the difference between the original power spectrum and
+       the extracted fractal spectrum offers an approximate estimate of the
+       power spectrum of the oscillatory component.
+
+    Note that an estimate of the original PSD can be calculated by simply
+    adding ``psd = psd_aperiodic + psd_oscillatory``.
+
+    For an example of how to use this function, please refer to
+    https://github.com/raphaelvallat/yasa/blob/master/notebooks/09_IRASA.ipynb
+
+    References
+    ----------
+    [1] Wen, H., & Liu, Z. (2016). Separating Fractal and Oscillatory
+    Components in the Power Spectrum of Neurophysiological Signal.
+    Brain Topography, 29(1), 13–26.
+    https://doi.org/10.1007/s10548-015-0448-0
+
+    [2] https://github.com/fieldtrip/fieldtrip/blob/master/specest/
+
+    [3] https://github.com/fooof-tools/fooof
+
+    [4] https://www.biorxiv.org/content/10.1101/299859v1
+    """
+    data, sf, ch_names = _check_irasa_input(data, sf, ch_names,
+                                            reject_bad_segs)
+    band = _check_band(band)
+    if decimate:
+        h_max = float(max(_resampling_ratios(hset, max_denominator)))
+        data, sf = _decimate(data, sf, band[1] * h_max, win_sec)
+    freqs, psd, psd_aperiodic = _irasa_decompose(
+        data, sf, hset, win_sec, kwargs_welch, n_jobs=n_jobs,
+        executor=executor, cache=cache, max_denominator=max_denominator,
+        median_method=median_method, psd_dtype=psd_dtype,
+        chunk_channels=chunk_channels, max_memory=max_memory,
+        reject_bad_segs=reject_bad_segs, engine=engine,
+        resampler=resampler)
+
+    # We can now calculate the oscillations (= periodic) component.
+    psd_osc = psd - psd_aperiodic
+
+    # Let's crop to the frequencies defined in band
+    freqs, psd_aperiodic, psd_osc = _crop_band(freqs, band, psd_aperiodic,
+                                               psd_osc)
+
+    if return_fit:
+        fit_params = _fit_aperiodic(freqs, psd_aperiodic, psd_osc, ch_names,
+                                    fit_method)
+        return freqs, psd_aperiodic, psd_osc, fit_params
+    else:
+        return freqs, psd_aperiodic, psd_osc
+
+
+def irasa_bands(data, bands, sf=None, ch_names=None,
+                hset=[1.1, 1.15, 1.2, 1.25, 1.3, 1.35, 1.4, 1.45, 1.5, 1.55,
+                      1.6, 1.65, 1.7, 1.75, 1.8, 1.85, 1.9], win_sec=4,
+                reject_bad_segs=True,
+                kwargs_welch=dict(average='mean', window='hann'),
+                n_jobs=1, executor=None, cache=None, fit_method='curve_fit',
+                decimate=False, max_denominator=None, median_method='exact',
+                psd_dtype=np.float64, chunk_channels=None, max_memory=None,
+                engine='signal', resampler='poly'):
+    """
+    Fit the IRASA aperiodic component in several frequency bands.
+
+    The resampling and PSD calculation, which do not depend on the band, are
+    computed only once. Calling this function is equivalent to calling
+    :py:func:`irasa` for each band, but costs about one IRASA run.
+
+    Parameters
+    ----------
+    data : :py:class:`numpy.ndarray` or :py:class:`mne.io.BaseRaw`
+        1D or 2D EEG data. See :py:func:`irasa`.
+    bands : list of tuples
+        Frequency ranges to fit, e.g. [(1, 30), (30, 45)].
+    sf, ch_names, hset, win_sec, reject_bad_segs, kwargs_welch, n_jobs, \
+executor, cache, fit_method, decimate, max_denominator, median_method, \
+psd_dtype, chunk_channels, max_memory, engine, resampler
+        See :py:func:`irasa`.
+
+    Returns
+    -------
+    freqs : :py:class:`numpy.ndarray`
+        Frequency vector, not cropped to any band. If ``decimate=True``,
+        only frequencies up to the decimated Nyquist frequency are returned.
+    psd_aperiodic : :py:class:`numpy.ndarray`
+        The fractal (= aperiodic) component of the PSD.
+    psd_oscillatory : :py:class:`numpy.ndarray`
+        The oscillatory (= periodic) component of the PSD.
+    fit_params : :py:class:`pandas.DataFrame`
+        Dataframe of fit parameters for each band and channel. The columns
+        ``fmin`` and ``fmax`` indicate the band.
+    """
+    data, sf, ch_names = _check_irasa_input(data, sf, ch_names,
+                                            reject_bad_segs)
+    bands = [_check_band(band) for band in bands]
+    if decimate:
+        fmax = (max(band[1] for band in bands)
+                * float(max(_resampling_ratios(hset, max_denominator))))
+        data, sf = _decimate(data, sf, fmax, win_sec)
+    freqs, psd, psd_aperiodic = _irasa_decompose(
+        data, sf, hset, win_sec, kwargs_welch, n_jobs=n_jobs,
+        executor=executor, cache=cache, max_denominator=max_denominator,
+        median_method=median_method, psd_dtype=psd_dtype,
+        chunk_channels=chunk_channels, max_memory=max_memory,
+        reject_bad_segs=reject_bad_segs, engine=engine,
+        resampler=resampler)
+    psd_osc = psd - psd_aperiodic
+
+    fit_params = []
+    for band in bands:
+        band_params = _fit_aperiodic(*_crop_band(freqs, band, psd_aperiodic,
+                                                 psd_osc), ch_names,
+                                     fit_method)
+        band_params.insert(0, 'fmax', band[1])
+        band_params.insert(0, 'fmin', band[0])
+        fit_params.append(band_params)
+    fit_params = pd.concat(fit_params, ignore_index=True)
+    return freqs, psd_aperiodic, psd_osc, fit_params
+
+
+def irasa_adaptive(data, sf=None, ch_names=None, band=(1, 30),
+                   hset=np.arange(1.1, 1.9, 0.01), return_fit=True,
+                   win_sec=4, kwargs_welch=dict(average='mean',
+                                                window='hann'),
+                   tol=0.01, min_factors=5, patience=3, fit_method='lstsq',
+                   max_denominator=None, n_jobs=1, executor=None,
+                   resampler='poly'):
+    """
+    IRASA with early stopping over the resampling factors.
+
+    The resampling factors are processed in a space-filling order (the
+    extremes first, then recursive midpoints) so that every prefix covers
+    the whole range of hset. Processing stops once the median aperiodic PSD
+    within band and the fitted slopes change by less than ``tol`` for
+    ``patience`` consecutive factors. The change of the aperiodic PSD is
+    measured as the mean absolute difference in log10 units across band,
+    maximized over the channels.
+
+    Parameters
+    ----------
+    data : :py:class:`numpy.ndarray` or :py:class:`mne.io.BaseRaw`
+        1D or 2D EEG data. See :py:func:`irasa`.
+    sf, ch_names, band, return_fit, win_sec, kwargs_welch, max_denominator, \
+n_jobs, executor, resampler
+        See :py:func:`irasa`.
+    hset : list or :py:class:`numpy.ndarray`
+        Candidate resampling factors. The default is a dense range of values
+        from 1.1 to 1.9 with an increment of 0.01.
+    tol : float
+        Tolerance for the change of the aperiodic PSD in log10 units and of
+        the slopes when adding a factor. The default is 0.01.
+    min_factors : int
+        Minimum number of resampling factors. The default is 5.
+    patience : int
+        Number of consecutive factors that must change the estimate by less
+        than ``tol``. The default is 3.
+    fit_method : str
+        See :py:func:`irasa`. The default is 'lstsq'.
+
+    Returns
+    -------
+    freqs, psd_aperiodic, psd_oscillatory, fit_params
+        See :py:func:`irasa`.
+    hset_used : :py:class:`numpy.ndarray`
+        Sorted resampling factors actually used.
+    """
+    data, sf, ch_names = _check_irasa_input(data, sf, ch_names)
+    band = _check_band(band)
+    ratios = _resampling_ratios(hset, max_denominator)
+    order = _space_filling_order(len(ratios))
+    win = int(win_sec * sf)  # nperseg
+    data = _split_bad_segs(data, win)
+    freqs, psd = calc_psd(data, sf, nperseg=win, **kwargs_welch)
+    freqs_band = _crop_band(freqs, band)[0]
+
+    factor_psd = partial(_irasa_factor_psd,
+                         resampler=_make_resampler(resampler, data, ratios,
+                                                   _hset_plans(hset)),
+                         sf=sf, win=win, kwargs_welch=kwargs_welch)
+    batch = _n_workers(n_jobs, executor)
+    psds = []
+    previous, stable = None, 0
+    for start in range(0, len(order), batch):
+        batch_ratios = [ratios[i] for i in order[start:start + batch]]
+        psds.extend(_map(factor_psd, batch_ratios, n_jobs, executor))
+        if len(psds) < min_factors:
+            continue
+        aperiodic_band = _crop_band(freqs, band, np.median(psds, axis=0))[1]
+        slopes = _fit_lstsq(freqs_band, aperiodic_band)[1]
+        if previous is not None:
+            psd_change = np.abs(np.log10(aperiodic_band / previous[0]))
+            change = max(psd_change.mean(axis=-1).max(),
+                         np.abs(slopes - previous[1]).max())
+            stable = stable + len(batch_ratios) if change < tol else 0
+            if stable >= patience:
+                break
+        previous = aperiodic_band, slopes
+    hset_used = np.sort([ratios[i].numerator / ratios[i].denominator
+                         for i in order[:len(psds)]])
+
+    psd_aperiodic = np.median(psds, axis=0)
+    psd_osc = psd - psd_aperiodic
+    freqs, psd_aperiodic, psd_osc = _crop_band(freqs, band, psd_aperiodic,
+                                               psd_osc)
+    if return_fit:
+        fit_params = _fit_aperiodic(freqs, psd_aperiodic, psd_osc, ch_names,
+                                    fit_method)
+        return freqs, psd_aperiodic, psd_osc, fit_params, hset_used
+    else:
+        return freqs, psd_aperiodic, psd_osc, hset_used
+
+
+def irasa_sweep(data, hsets, sf=None, ch_names=None, band=(1, 30),
+                return_fit=True, win_sec=4,
+                kwargs_welch=dict(average='mean', window='hann'),
+                fit_method='curve_fit', max_denominator=None, n_jobs=1,
+                executor=None, resampler='poly'):
+    """
+    IRASA for several hsets on the same data.
+
+    The resampled PSD of each unique factor across all hsets is computed
+    only once. The aperiodic component of each hset is then the median over
+    the shared PSDs of its factors. This is equivalent to calling
+    :py:func:`irasa` for each hset, e.g. when sweeping the maximum
+    resampling factor.
+
+    Parameters
+    ----------
+    data : :py:class:`numpy.ndarray` or :py:class:`mne.io.BaseRaw`
+        1D or 2D EEG data. See :py:func:`irasa`.
+    hsets : list of lists or :py:class:`numpy.ndarray`
+        Resampling factors of each IRASA run.
+    sf, ch_names, band, return_fit, win_sec, kwargs_welch, fit_method, \
+max_denominator, n_jobs, executor, resampler
+        See :py:func:`irasa`.
+
+    Returns
+    -------
+    results : list of tuples
+        Output of :py:func:`irasa` for each hset.
+    """
+    data, sf, ch_names = _check_irasa_input(data, sf, ch_names)
+    band = _check_band(band)
+    ratio_sets = [_resampling_ratios(hset, max_denominator) for hset in hsets]
+    unique_ratios = sorted(set().union(*ratio_sets))
+    win = int(win_sec * sf)  # nperseg
+    data = _split_bad_segs(data, win)
+    freqs, psd = calc_psd(data, sf, nperseg=win, **kwargs_welch)
+
+    # Resample once for each unique factor and keep only the band
+    factor_psd = partial(_irasa_factor_psd,
+                         resampler=_make_resampler(
+                             resampler, data, unique_ratios,
+                             {rat: plan for hset in hsets
+                              for rat, plan in _hset_plans(hset).items()}),
+                         sf=sf, win=win, kwargs_welch=kwargs_welch)
+    psd_factors = {rat: _crop_band(freqs, band, psd_h)[1] for rat, psd_h
+                   in zip(unique_ratios, _map(factor_psd, unique_ratios,
+                                              n_jobs, executor))}
+    freqs, psd = _crop_band(freqs, band, psd)
+
+    results = []
+    for ratios in ratio_sets:
+        psd_aperiodic = np.median([psd_factors[rat] for rat in ratios],
+                                  axis=0)
+        psd_osc = psd - psd_aperiodic
+        if return_fit:
+            fit_params = _fit_aperiodic(freqs, psd_aperiodic, psd_osc,
+                                        ch_names, fit_method)
+            results.append((freqs, psd_aperiodic, psd_osc, fit_params))
+        else:
+            results.append((freqs, psd_aperiodic, psd_osc))
+    return results
+
+
+def _space_filling_order(n):
+    """Order range(n) as extremes followed by breadth-first midpoints."""
+    order = [0, n - 1] if n > 1 else [0]
+    intervals = deque([(0, n - 1)])
+    while intervals:
+        low, high = intervals.popleft()
+        if high - low < 2:
+            continue
+        mid = (low + high) // 2
+        order.append(mid)
+        intervals.extend([(low, mid), (mid, high)])
+    return order
+
+
+def irasa_stream(source, sf=None, ch_names=None, band=(1, 30),
+                 hset=[1.1, 1.15, 1.2, 1.25, 1.3, 1.35, 1.4, 1.45, 1.5, 1.55,
+                       1.6, 1.65, 1.7, 1.75, 1.8, 1.85, 1.9], return_fit=True,
+                 win_sec=4, chunk_sec=60, kwargs_welch=dict(window='hann'),
+                 fit_method='curve_fit', max_denominator=None):
+    """
+    IRASA for recordings that do not fit in memory.
+
+    The signal is read in overlapping chunks and each chunk is resampled by
+    h and 1/h. The Welch segments of the resampled signals are accumulated
+    across chunks, so memory is bounded by the chunk size rather than the
+    recording length. The result is the same as :py:func:`irasa` with
+    ``average='mean'``. The data is read ``len(hset) + 1`` times.
+
+    Parameters
+    ----------
+    source : str, :py:class:`numpy.ndarray` or :py:class:`mne.io.BaseRaw`
+        Path to a .npy file, which is memory-mapped, a (memory-mapped) array
+        of shape (nchan, n_samples), or a :py:class:`mne.io.BaseRaw`, which
+        does not need to be preloaded. MNE data is converted to micro-Volts.
+    sf, ch_names, band, hset, return_fit, win_sec, fit_method, \
+max_denominator
+        See :py:func:`irasa`.
+    chunk_sec : int or float
+        Length of the chunks read at once in seconds. The default is 60.
+    kwargs_welch : dict
+        Optional keywords arguments for the Welch PSD. Only
+        ``average='mean'`` is supported.
+
+    Returns
+    -------
+    See :py:func:`irasa`.
+    """
+    kwargs_welch = dict(kwargs_welch)
+    if kwargs_welch.pop('average', 'mean') != 'mean':
+        raise ValueError("irasa_stream only supports average='mean'.")
+    kwargs_welch = _check_welch_kwargs(kwargs_welch)
+    reader, n_times, sf, ch_names = _open_stream(source, sf, ch_names)
+    band = _check_band(band)
+    ratios = _resampling_ratios(hset, max_denominator)
+    win = int(win_sec * sf)  # nperseg
+    chunk_len = int(chunk_sec * sf)
+
+    # Calculate the original PSD over the whole data
+    welch = _WelchAccumulator(sf, win, **kwargs_welch)
+    for block, in _stream_resample(reader, n_times, [(1, 1)], chunk_len):
+        welch.update(block)
+    freqs, psd = welch.result()
+
+    # Start the IRASA procedure
+    psds = np.zeros((len(ratios), *psd.shape))
+    for i, rat in enumerate(ratios):
+        up, down = rat.numerator, rat.denominator
+        h = up / down
+        welch_up = _WelchAccumulator(h * sf, win, **kwargs_welch)
+        welch_dw = _WelchAccumulator(sf / h, win, **kwargs_welch)
+        for block_up, block_dw in _stream_resample(
+                reader, n_times, [(up, down), (down, up)], chunk_len):
+            welch_up.update(block_up)
+            welch_dw.update(block_dw)
+        # Geometric mean of h and 1/h
+        psds[i, :] = np.sqrt(welch_up.result()[1] * welch_dw.result()[1])
+    psd_aperiodic = np.median(psds, axis=0)
+    psd_osc = psd - psd_aperiodic
+
+    freqs, psd_aperiodic, psd_osc = _crop_band(freqs, band, psd_aperiodic,
+                                               psd_osc)
+    if return_fit:
+        fit_params = _fit_aperiodic(freqs, psd_aperiodic, psd_osc, ch_names,
+                                    fit_method)
+        return freqs, psd_aperiodic, psd_osc, fit_params
+    else:
+        return freqs, psd_aperiodic, psd_osc
+
+
+def irasa_sliding(data, sf=None, ch_names=None, band=(1, 30),
+                  hset=[1.1, 1.15, 1.2, 1.25, 1.3, 1.35, 1.4, 1.45, 1.5,
+                        1.55, 1.6, 1.65, 1.7, 1.75, 1.8, 1.85, 1.9],
+                  window_sec=60, step_sec=None, win_sec=4,
+                  kwargs_welch=dict(window='hann'), fit_method='lstsq',
+                  max_denominator=None, n_jobs=1, executor=None):
+    """
+    Time-resolved IRASA on sliding windows.
+
+    The whole signal is resampled once per factor and the Welch segment
+    periodograms are computed once. The PSD of each window is the mean of
+    the segments that lie completely inside the window. Overlapping windows
+    therefore share the segment computations and the cost grows with the
+    recording length rather than with the number of windows.
+
+    Parameters
+    ----------
+    data : :py:class:`numpy.ndarray` or :py:class:`mne.io.BaseRaw`
+        1D or 2D EEG data. See :py:func:`irasa`.
+    sf, ch_names, band, hset, win_sec, max_denominator, n_jobs, executor
+        See :py:func:`irasa`.
+    window_sec : int or float
+        Length of the sliding windows in seconds, at least ``win_sec``.
+        The default is 60.
+    step_sec : int or float, optional
+        Step between window starts in seconds. The default is None, which
+        uses half the window length.
+    kwargs_welch : dict
+        Optional keywords arguments for the Welch PSD. Only
+        ``average='mean'`` is supported.
+    fit_method : str
+        See :py:func:`irasa`. The default is 'lstsq', which fits all channels
+        and windows at once.
+
+    Returns
+    -------
+    times : :py:class:`numpy.ndarray`
+        Centers of the windows in seconds.
+    freqs : :py:class:`numpy.ndarray`
+        Frequency vector cropped to band.
+    psd_aperiodic : :py:class:`numpy.ndarray`
+        Aperiodic spectrogram of shape (nchan, nfreqs, ntimes).
+    psd_oscillatory : :py:class:`numpy.ndarray`
+        Oscillatory spectrogram of shape (nchan, nfreqs, ntimes).
+    fit_params : :py:class:`pandas.DataFrame`
+        Fit parameters for each channel and window. The column ``Time``
+        indicates the window center.
+    """
+    kwargs_welch = dict(kwargs_welch)
+    if kwargs_welch.pop('average', 'mean') != 'mean':
+        raise ValueError("irasa_sliding only supports average='mean'.")
+    kwargs_welch = _check_welch_kwargs(kwargs_welch)
+    data, sf, ch_names = _check_irasa_input(data, sf, ch_names)
+    band = _check_band(band)
+    ratios = _resampling_ratios(hset, max_denominator)
+    win = int(win_sec * sf)  # nperseg
+    if step_sec is None:
+        step_sec = window_sec / 2
+    starts = np.arange(0, data.shape[-1] / sf - window_sec + 1e-9, step_sec)
+    assert window_sec >= win_sec, 'window_sec must be at least win_sec.'
+    assert starts.size, 'window_sec must not exceed the length of the data.'
+    freqs = np.fft.rfftfreq(kwargs_welch.get('nfft') or win, 1 / sf)
+    mask_freqs = (freqs >= band[0]) & (freqs <= band[1])
+
+    psd = _window_psd(data, sf, win, starts, window_sec, mask_freqs,
+                      kwargs_welch)
+    psds = np.zeros((len(ratios), *psd.shape))
+    factor_psd = partial(_irasa_sliding_factor_psd, data=data, sf=sf,
+                         win=win, starts=starts, window_sec=window_sec,
+                         mask_freqs=mask_freqs, kwargs_welch=kwargs_welch,
+                         plans=_hset_plans(hset))
+    for i, psd_h in enumerate(_map(factor_psd, ratios, n_jobs, executor)):
+        psds[i, :] = psd_h
+    psd_aperiodic = np.median(psds, axis=0)
+    psd_osc = psd - psd_aperiodic
+    freqs = freqs[mask_freqs]
+
+    # Fit all windows of all channels
+    nchan, nfreq, ntimes = psd_aperiodic.shape
+    times = starts + window_sec / 2
+    fit_params = _fit_aperiodic(
+        freqs, psd_aperiodic.transpose(0, 2, 1).reshape(-1, nfreq),
+        psd_osc.transpose(0, 2, 1).reshape(-1, nfreq),
+        np.repeat(ch_names, ntimes), fit_method)
+    fit_params.insert(1, 'Time', np.tile(times, nchan))
+    return times, freqs, psd_aperiodic, psd_osc, fit_params
+
+
+def _irasa_sliding_factor_psd(rat, data, sf, win, starts, window_sec,
+                              mask_freqs, kwargs_welch, plans=None):
+    """Geometric mean of the windowed PSDs of data resampled by rat."""
+    plan = _resample_plan(rat, plans)
+    h = plan.h
+    data_up = plan.resample(data)
+    data_down = plan.resample(data, inverse=True)
+    psd_up = _window_psd(data_up, h * sf, win, starts, window_sec,
+                         mask_freqs, kwargs_welch)
+    psd_dw = _window_psd(data_down, sf / h, win, starts, window_sec,
+                         mask_freqs, kwargs_welch)
+    return np.sqrt(psd_up * psd_dw)
+
+
+def _window_psd(x, fs, nperseg, starts, window_sec, mask_freqs,
+                kwargs_welch):
+    """
+    Mean periodogram of the Welch segments inside each window.
+
+    Segments containing nan are excluded. Window means are obtained from
+    cumulative sums over the segments.
+
+    Returns
+    -------
+    psd : ndarray
+        PSD of shape (nchan, nfreq, nwindows).
+    """
+    pxx = _segment_periodograms(x, fs, nperseg, freq_mask=mask_freqs,
+                                **kwargs_welch)
+    noverlap = kwargs_welch.get('noverlap')
+    step = nperseg - (nperseg // 2 if noverlap is None else noverlap)
+    valid = ~np.isnan(pxx[..., :1])
+    pxx[np.broadcast_to(~valid, pxx.shape)] = 0
+    zeros = np.zeros((*pxx.shape[:-2], 1, pxx.shape[-1]))
+    csum = np.concatenate([zeros, np.cumsum(pxx, axis=-2)], axis=-2)
+    ccount = np.concatenate([zeros[..., :1], np.cumsum(valid, axis=-2)],
+                            axis=-2)
+
+    # Segments that lie completely inside the windows
+    nseg = pxx.shape[-2]
+    first = np.clip(np.ceil(starts * fs / step - 1e-9).astype(int), 0, nseg)
+    stop = np.floor(((starts + window_sec) * fs - nperseg) / step + 1e-9)
+    stop = np.clip(stop.astype(int) + 1, first, nseg)
+    with np.errstate(invalid='ignore'):
+        psd = ((csum[..., stop, :] - csum[..., first, :])
+               / (ccount[..., stop, :] - ccount[..., first, :]))
+    return np.moveaxis(psd, -2, -1)
+
+
+def _open_stream(source, sf, ch_names):
+    """Return reader(start, stop), number of samples, sf, and ch_names."""
+    if isinstance(source, mne.io.BaseRaw):
+        def reader(start, stop):
+            # Convert from V to uV
+            return source.get_data(start=start, stop=stop) * 1e6
+        return reader, source.n_times, source.info['sfreq'], source.ch_names
+    if isinstance(source, (str, os.PathLike)):
+        source = np.load(source, mmap_mode='r')
+    # np.atleast_2d keeps memory maps unread
+    source, sf, ch_names = _check_irasa_input(source, sf, ch_names)
+
+    def reader(start, stop):
+        return np.asarray(source[:, start:stop], dtype=float)
+    return reader, source.shape[-1], sf, ch_names
+
+
+def _stream_resample(reader, n_times, rates, chunk_len):
+    """
+    Yield consecutive blocks of resample_poly(data, up, down) for each rate.
+
+    The chunk borders are aligned to the resampling ratios, and each chunk is
+    read with more than the filter half length on both sides. Therefore,
+    the concatenated blocks equal resampling the whole signal at once.
+    """
+    align = int(np.lcm.reduce([down for up, down in rates]))
+    half_len = max(10 * max(up, down) / up for up, down in rates)
+    pad = int(np.ceil((half_len + 1) / align)) * align
+    chunk_len = max(chunk_len // align, 1) * align
+    for start in range(0, n_times, chunk_len):
+        stop = min(start + chunk_len, n_times)
+        first, last = max(start - pad, 0), min(stop + pad, n_times)
+        chunk = reader(first, last)
+        blocks = []
+        for up, down in rates:
+            if up == down:
+                blocks.append(chunk[..., start - first:stop - first])
+                continue
+            plan = _resample_plan(fractions.Fraction(max(up, down),
+                                                     min(up, down)))
+            resampled = plan.resample(chunk, inverse=up < down)
+            offset = first * up // down
+            blocks.append(resampled[..., start * up // down - offset:
+                                    -(-stop * up // down) - offset])
+        yield blocks
+
+
+def _check_irasa_input(data, sf, ch_names, reject_bad_segs=True):
+    """
+    Return data as 2D array, sampling frequency, and channel names.
+
+    If reject_bad_segs is True, bad segments of MNE Raw data are set to NaN.
+    """
+    # Check if input data is a MNE Raw object
+    if isinstance(data, mne.io.BaseRaw):
+        sf = data.info['sfreq']  # Extract sampling frequency
+        ch_names = data.ch_names  # Extract channel names
+        # Convert from V to uV
+        reject_by_annotation = "nan" if reject_bad_segs else None
+        data = data.get_data(reject_by_annotation=reject_by_annotation) * 1e6
+    else:
+        # Safety checks
         assert isinstance(data, np.ndarray), 'Data must be a numpy array.'
         data = np.atleast_2d(data)
         assert data.ndim == 2, 'Data must be of shape (nchan, n_samples).'
@@ -432,17 +2483,169 @@ def irasa(data, sf=None, ch_names=None, band=(1, 30),
             ch_names = np.atleast_1d(np.asarray(ch_names, dtype=str))
             assert ch_names.ndim == 1, 'ch_names must be 1D.'
             assert len(ch_names) == nchan, 'ch_names must match data.shape[0].'
+    return data, sf, ch_names
+
+
+def _check_band(band):
+    """Return band sorted."""
+    band = sorted(band)
+    assert band[0] > 0, 'first element of band must be > 0.'
+    # assert band[1] < (sf / 4), 'second element of band should be < (sf / 4).'
+    return band
+
 
-    # Check the other arguments
+def _check_hset(hset):
+    """Return hset as 1D array rounded to 4 decimals."""
     hset = np.asarray(hset)
     assert hset.ndim == 1, 'hset must be 1D.'
     assert hset.size > 1, '2 or more resampling fators are required.'
     hset = np.round(hset, 4)  # avoid float precision error with np.arange.
-    band = sorted(band)
-    assert band[0] > 0, 'first element of band must be > 0.'
-    # assert band[1] < (sf / 4), 'second element of band should be < (sf / 4).'
+    return hset
+
+
+def _good_spans(data):
+    """
+    Return start and stop indices of the spans between bad samples.
+
+    Samples are bad if they are NaN in every channel, as bad segments of MNE
+    Raw data. NaN in single channels are left to the NaN-aware Welch
+    averages of :py:func:`calc_psd`.
+    """
+    good = ~np.isnan(data).all(axis=0)
+    edges = np.flatnonzero(np.diff(np.r_[0, good.astype(np.int8), 0]))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def _split_bad_segs(data, min_len=1):
+    """
+    Split data into the good spans between NaN (bad) segments.
+
+    Returns data unchanged if no sample is NaN in every channel, otherwise a
+    list of the spans with at least min_len samples. Resampling the spans
+    separately prevents the NaN from spreading into the good data next to
+    bad segments.
+    """
+    if not np.isnan(data).all(axis=0).any():
+        return data
+    return [data[:, start:stop] for start, stop in _good_spans(data)
+            if stop - start >= min_len]
+
+
+def _decimate(data, sf, fmax, win_sec, passband=0.8):
+    """
+    Decimate data to the lowest sample rate that still covers fmax.
+
+    The anti-aliasing filter of :py:func:`scipy.signal.resample_poly` is flat
+    up to 80% of the new Nyquist frequency. The decimation factor divides
+    the Welch window length so that the frequency resolution is unchanged.
+    """
+    win = int(win_sec * sf)
+    q_max = int(passband * sf / (2 * fmax))
+    q = max([q for q in range(1, q_max + 1) if win % q == 0], default=1)
+    if fmax > sf / 2:
+        warnings.warn(f"band[1] * max(hset) = {fmax:.1f}Hz exceeds the "
+                      f"Nyquist frequency of {sf / 2:.1f}Hz. The resampled "
+                      "PSDs do not cover the upper band. Data is not "
+                      "decimated.")
+    elif q == 1:
+        warnings.warn(f"band[1] * max(hset) = {fmax:.1f}Hz is too close to "
+                      f"the Nyquist frequency of {sf / 2:.1f}Hz to decimate "
+                      "without aliasing. Data is not decimated.")
+    elif np.isnan(data).any():
+        # Decimate the good spans separately and keep a NaN gap between them
+        decimated = np.full(data.shape[:-1] + (-(-data.shape[-1] // q),),
+                            np.nan)
+        for start, stop in _good_spans(data):
+            first, last = -(-start // q), stop // q
+            decimated[:, first:last] = sig.resample_poly(
+                data[:, start:stop], 1, q, axis=-1)[:, :last - first]
+        data, sf = decimated, sf / q
+    else:
+        data = sig.resample_poly(data, 1, q, axis=-1)
+        sf = sf / q
+    return data, sf
+
+
+def _irasa_decompose(data, sf, hset, win_sec, kwargs_welch, n_jobs=1,
+                     executor=None, cache=None, max_denominator=None,
+                     median_method='exact', psd_dtype=np.float64,
+                     chunk_channels=None, max_memory=None,
+                     reject_bad_segs=True, engine='signal', resampler='poly'):
+    """Return freqs, original PSD, and aperiodic PSD (not cropped)."""
+    ratios = _resampling_ratios(hset, max_denominator)
+    plans = _hset_plans(hset)
+    if median_method not in _MEDIANS:
+        raise ValueError("median_method must be 'exact' or 'p2', "
+                         f"got {median_method!r}.")
+    if engine not in ('signal', 'segment'):
+        raise ValueError("engine must be 'signal' or 'segment', "
+                         f"got {engine!r}.")
+    if resampler not in ('auto', *_RESAMPLERS):
+        raise ValueError("resampler must be 'auto', 'poly' or 'fft', "
+                         f"got {resampler!r}.")
+    if engine == 'segment' and resampler == 'fft':
+        raise ValueError("engine='segment' only supports resampler='poly'.")
+    if cache is not None:
+        key = cache.key(data, float(sf), [str(rat) for rat in ratios], win_sec,
+                        sorted(kwargs_welch.items()), median_method,
+                        np.dtype(psd_dtype).str, reject_bad_segs, engine,
+                        resampler, [plan.taps for plan in plans.values()])
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
     win = int(win_sec * sf)  # nperseg
 
+    blocks = _channel_blocks(data.shape, max(ratios), chunk_channels,
+                             max_memory, _n_workers(n_jobs, executor))
+    # Split all channels at the same bad segments, independent of the blocks
+    if reject_bad_segs:
+        data = _split_bad_segs(data, win)
+    decomposed = [_irasa_median(_channel_block(data, block), sf, ratios, win,
+                                kwargs_welch, n_jobs, executor, median_method,
+                                psd_dtype, engine, resampler, plans)
+                  for block in blocks]
+    freqs = decomposed[0][0]
+    psd = np.concatenate([block_psd for _, block_psd, _ in decomposed])
+    psd_aperiodic = np.concatenate([block_ap for *_, block_ap in decomposed])
+    if cache is not None:
+        cache.put(key, (freqs, psd, psd_aperiodic))
+    return freqs, psd, psd_aperiodic
+
+
+def _channel_blocks(shape, h_max, chunk_channels=None, max_memory=None,
+                    n_workers=1):
+    """
+    Split the channels into blocks that are processed one after another.
+
+    The peak memory of IRASA is roughly (3 + 4 * h_max) times the size of
+    the data, per resampling factor processed in parallel.
+    """
+    nchan, npts = shape
+    if max_memory is not None:
+        bytes_per_channel = 8 * npts * (3 + 4 * float(h_max)) * n_workers
+        chunk_channels = int(max_memory // bytes_per_channel)
+        if chunk_channels < 1:
+            warnings.warn(f"max_memory={max_memory:.0f} bytes is smaller than "
+                          f"the estimated {bytes_per_channel:.0f} bytes "
+                          "required for a single channel.")
+            chunk_channels = 1
+    if chunk_channels is None:
+        return [slice(None)]
+    return [slice(start, start + chunk_channels)
+            for start in range(0, nchan, chunk_channels)]
+
+
+def _channel_block(data, block):
+    """Select a block of channels of data or of each of its spans."""
+    if isinstance(data, list):
+        return [span[block] for span in data]
+    return data[block]
+
+
+def _irasa_median(data, sf, ratios, win, kwargs_welch, n_jobs=1,
+                  executor=None, median_method='exact', psd_dtype=np.float64,
+                  engine='signal', resampler='poly', plans=None):
+    """Return freqs, original PSD, and median of the resampled PSDs."""
     # Calculate the original PSD over the whole data
     # ==========================================================================
     #   MG: CHANGED TO ALLOW NAN SEGMENTS
@@ -450,72 +2653,103 @@ def irasa(data, sf=None, ch_names=None, band=(1, 30),
     # ==========================================================================
 
     # Start the IRASA procedure
-    psds = np.zeros((len(hset), *psd.shape))
+    median = _MEDIANS[median_method](len(ratios), psd_dtype)
 
-    for i, h in enumerate(hset):
-        # Get the upsampling/downsampling (h, 1/h) factors as integer
-        rat = fractions.Fraction(str(h))
-        up, down = rat.numerator, rat.denominator
-        # Much faster than FFT-based resampling
-        data_up = sig.resample_poly(data, up, down, axis=-1)
-        data_down = sig.resample_poly(data, down, up, axis=-1)
-        # Calculate the PSD using same params as original
-        # ======================================================================
-        # MG: CHANGED TO ALLOW NAN SEGMENTS
-        freqs_up, psd_up = calc_psd(data_up, h * sf, nperseg=win,
-                                    **kwargs_welch)
-        freqs_dw, psd_dw = calc_psd(data_down, sf / h, nperseg=win,
-                                    **kwargs_welch)
-        # ======================================================================
-        # Geometric mean of h and 1/h
-        psds[i, :] = np.sqrt(psd_up * psd_dw)
+    if engine == 'segment':
+        factor_psd = partial(_irasa_segment_factor_psd, data=data, sf=sf,
+                             win=win, kwargs_welch=kwargs_welch,
+                             h_max=float(max(ratios)), plans=plans)
+    else:
+        factor_psd = partial(_irasa_factor_psd,
+                             resampler=_make_resampler(resampler, data,
+                                                       ratios, plans),
+                             sf=sf, win=win, kwargs_welch=kwargs_welch)
+    for psd_h in _map(factor_psd, ratios, n_jobs, executor):
+        median.update(psd_h)
 
     # Now we take the median PSD of all the resampling factors, which gives
     # a good estimate of the aperiodic component of the PSD.
-    psd_aperiodic = np.median(psds, axis=0)
+    psd_aperiodic = median.result().astype(psd.dtype)
+    return freqs, psd, psd_aperiodic
 
-    # We can now calculate the oscillations (= periodic) component.
-    psd_osc = psd - psd_aperiodic
 
-    # Let's crop to the frequencies defined in band
+def _crop_band(freqs, band, *psds):
+    """Crop freqs and PSDs to the frequencies defined in band."""
     mask_freqs = np.ma.masked_outside(freqs, *band).mask
     freqs = freqs[~mask_freqs]
-    psd_aperiodic = np.compress(~mask_freqs, psd_aperiodic, axis=-1)
-    psd_osc = np.compress(~mask_freqs, psd_osc, axis=-1)
+    psds = [np.compress(~mask_freqs, psd, axis=-1) for psd in psds]
+    return (freqs, *psds)
 
-    if return_fit:
-        # Aperiodic fit in semilog space for each channel
-        from scipy.optimize import curve_fit
-        intercepts, slopes, r_squared = [], [], []
-
-        def func(t, a, b):
-            # See https://github.com/fooof-tools/fooof
-            # ==================================================================
-            # MG: CORRECTED: NP.LOG -> NP.LOG10
-            return a + np.log10(t**b)
-            # ==================================================================
-
-        for y in np.atleast_2d(psd_aperiodic):
-            # ==================================================================
-            # MG: CORRECTED: NP.LOG -> NP.LOG10
-            y_log = np.log10(y)
-            # ==================================================================
-            # Note that here we define bounds for the slope but not for the
-            # intercept.
-            popt, pcov = curve_fit(func, freqs, y_log, p0=(2, -1),
-                                   bounds=((-np.inf, -10), (np.inf, 2)))
-            intercepts.append(popt[0])
-            slopes.append(popt[1])
-            # Calculate R^2: https://stackoverflow.com/q/19189362/10581531
-            residuals = y_log - func(freqs, *popt)
-            ss_res = np.sum(residuals**2)
-            ss_tot = np.sum((y_log - np.mean(y_log))**2)
-            r_squared.append(1 - (ss_res / ss_tot))
-
-        # Create fit parameters dataframe
-        fit_params = {'Chan': ch_names, 'Intercept': intercepts,
-                      'Slope': slopes, 'R^2': r_squared,
-                      'std(osc)': np.std(psd_osc, axis=-1, ddof=1)}
-        return freqs, psd_aperiodic, psd_osc, pd.DataFrame(fit_params)
+
+def _fit_aperiodic(freqs, psd_aperiodic, psd_osc, ch_names,
+                   fit_method='curve_fit'):
+    """Fit the aperiodic PSD in semilog space for each channel."""
+    if fit_method == 'curve_fit':
+        intercepts, slopes, r_squared = _fit_curve_fit(freqs, psd_aperiodic)
+    elif fit_method == 'lstsq':
+        intercepts, slopes, r_squared = _fit_lstsq(freqs, psd_aperiodic)
     else:
-        return freqs, psd_aperiodic, psd_osc
+        raise ValueError("fit_method must be 'curve_fit' or 'lstsq', "
+                         f"got {fit_method!r}.")
+
+    # Create fit parameters dataframe
+    fit_params = {'Chan': ch_names, 'Intercept': intercepts,
+                  'Slope': slopes, 'R^2': r_squared,
+                  'std(osc)': np.std(psd_osc, axis=-1, ddof=1)}
+    return pd.DataFrame(fit_params)
+
+
+def _fit_curve_fit(freqs, psd_aperiodic):
+    """Fit each channel separately with curve_fit."""
+    from scipy.optimize import curve_fit
+    intercepts, slopes, r_squared = [], [], []
+
+    def func(t, a, b):
+        # See https://github.com/fooof-tools/fooof
+        # ======================================================================
+        # MG: CORRECTED: NP.LOG -> NP.LOG10
+        return a + np.log10(t**b)
+        # ======================================================================
+
+    for y in np.atleast_2d(psd_aperiodic):
+        # ======================================================================
+        # MG: CORRECTED: NP.LOG -> NP.LOG10
+        y_log = np.log10(y)
+        # ======================================================================
+        # Note that here we define bounds for the slope but not for the
+        # intercept.
+        popt, pcov = curve_fit(func, freqs, y_log, p0=(2, -1),
+                               bounds=((-np.inf, -10), (np.inf, 2)))
+        intercepts.append(popt[0])
+        slopes.append(popt[1])
+        # Calculate R^2: https://stackoverflow.com/q/19189362/10581531
+        residuals = y_log - func(freqs, *popt)
+        ss_res = np.sum(residuals**2)
+        ss_tot = np.sum((y_log - np.mean(y_log))**2)
+        r_squared.append(1 - (ss_res / ss_tot))
+    return intercepts, slopes, r_squared
+
+
+def _fit_lstsq(freqs, psd_aperiodic, slope_bounds=(-10, 2)):
+    """
+    Fit all channels at once with linear least squares.
+
+    The model a + log10(f**b) = a + b * log10(f) is linear in a and b.
+    If the unconstrained slope violates the bounds, the constrained optimum
+    lies on the bound and the intercept is the mean residual.
+    """
+    x_log = np.log10(freqs)
+    y_log = np.log10(np.atleast_2d(psd_aperiodic)).T  # (nfreq, nchan)
+    design = np.column_stack([np.ones_like(x_log), x_log])
+    (intercepts, slopes), *_ = np.linalg.lstsq(design, y_log, rcond=None)
+    clipped = np.clip(slopes, *slope_bounds)
+    bounded = clipped != slopes
+    slopes = clipped
+    intercepts[bounded] = np.mean(y_log[:, bounded]
+                                  - slopes[bounded] * x_log[:, None], axis=0)
+    # Calculate R^2: https://stackoverflow.com/q/19189362/10581531
+    residuals = y_log - (intercepts + slopes * x_log[:, None])
+    ss_res = np.sum(residuals**2, axis=0)
+    ss_tot = np.sum((y_log - np.mean(y_log, axis=0))**2, axis=0)
+    r_squared = 1 - (ss_res / ss_tot)
+    return intercepts, slopes, r_squared